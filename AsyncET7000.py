@@ -0,0 +1,331 @@
+import os, sys
+if os.path.realpath('../TangoUtils') not in sys.path: sys.path.append(os.path.realpath('../TangoUtils'))
+
+import asyncio
+
+from config_logger import config_logger
+from log_exception import log_exception
+from ET7000 import ET7000, NaN
+from ModbusTransport import AsyncModbusTransport
+
+
+# asyncio version of ET7000. Use "et = await AsyncET7000.connect(host)" to create connected device.
+class AsyncET7000:
+    ranges = ET7000.ranges
+    configure_ai = ET7000.configure_ai
+    configure_ao = ET7000.configure_ao
+
+    def __init__(self, host: str, port=502, timeout=0.5, client=None, **kwargs):
+        # no io here, call connect() or discover() to read device configuration
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.ao_correct_output = kwargs.pop('ao_correct_output', True)
+        self.logger = kwargs.pop('logger', None) or config_logger()
+        # defaults
+        self.is_open = False
+        self.type = 0
+        self.type_str = '0000'
+        self.ai_n = 0
+        self.ai_masks = []
+        self.ai_ranges = []
+        self.configure_ai()
+        self.ao_n = 0
+        self.ao_masks = []
+        self.ao_ranges = []
+        self.configure_ao()
+        self.di_n = 0
+        self.do_n = 0
+        # modbus client
+        if client is None:
+            self.client = AsyncModbusTransport(host, port, timeout=timeout)
+        else:
+            self.client = client
+
+    @classmethod
+    async def connect(cls, host: str, port=502, timeout=0.5, client=None, **kwargs):
+        et = cls(host, port=port, timeout=timeout, client=client, **kwargs)
+        await et.discover()
+        return et
+
+    async def discover(self):
+        self.is_open = await self.client.open()
+        if not self.is_open:
+            self.logger.warning('ET-7xxx device at %s is offline' % self.host)
+            return False
+        # read module type
+        self.type = await self.read_module_type()
+        self.type_str = hex(self.type).replace('0x', '')
+        # ai
+        self.ai_n = await self.ai_read_n()
+        self.ai_masks = await self.ai_read_masks()
+        self.ai_ranges = await self.ai_read_ranges()
+        self.configure_ai()
+        # ao
+        self.ao_n = await self.ao_read_n()
+        self.ao_masks = [True] * self.ao_n
+        self.ao_ranges = await self.ao_read_ranges()
+        self.configure_ao()
+        # di
+        self.di_n = await self.di_read_n()
+        # do
+        self.do_n = await self.do_read_n()
+        self.logger.debug('ET-%s at %s has been created' % (self.type_str, self.host))
+        return True
+
+    async def close(self):
+        try:
+            await self.client.close()
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(f'ET-{self.type_str} {self.host} client closing error')
+
+    async def _read_first(self, function, addresses):
+        # first nonzero register from list of alternative addresses
+        regs = None
+        for addr in addresses:
+            regs = await function(addr, 1)
+            if regs and regs[0] != 0:
+                return regs[0]
+        if regs:
+            return regs[0]
+        return 0
+
+    async def read_module_type(self):
+        if not self.is_open:
+            return 0
+        return await self._read_first(self.client.read_holding_registers, (559, 260))
+
+    # AI functions
+    async def ai_read_n(self):
+        if not self.is_open:
+            return 0
+        return await self._read_first(self.client.read_input_registers, (320, 120))
+
+    async def ai_read_masks(self):
+        if self.ai_n <= 0:
+            self.logger.info('Device has no ai channels')
+            return []
+        coils = await self.client.read_coils(595, self.ai_n)
+        if coils and len(coils) == self.ai_n:
+            return coils
+        self.logger.info('Error reading masks')
+        return [False] * self.ai_n
+
+    async def ai_read_ranges(self):
+        if self.ai_n <= 0:
+            self.logger.info('Device has no ai channels')
+            return []
+        regs = await self.client.read_holding_registers(427, self.ai_n)
+        if regs and len(regs) == self.ai_n:
+            return regs
+        self.logger.info('Error reading ranges')
+        return [0xff] * self.ai_n
+
+    async def ai_read(self, channel=None):
+        if channel is not None:
+            return await self.ai_read_channel(channel)
+        if self.ai_n <= 0:
+            self.logger.info('Device has no ai channels')
+            return None
+        regs = await self.client.read_input_registers(0, self.ai_n)
+        if regs and len(regs) == self.ai_n:
+            return self.ai_table.values(regs).tolist()
+        self.logger.info('Error reading channels')
+        return [NaN] * self.ai_n
+
+    async def ai_read_channel(self, channel: int):
+        if self.ai_n <= 0:
+            self.logger.info('Device has no ai channels')
+            return None
+        if not self.ai_masks[channel]:
+            self.logger.info('Read for masked ai channel %s ignored' % channel)
+            return NaN
+        regs = await self.client.read_input_registers(channel, 1)
+        if regs:
+            return self.ai_table.value(channel, regs[0])
+        self.logger.info('Error reading channel')
+        return None
+
+    async def ai_write_masks(self, masks):
+        if self.ai_n <= 0:
+            self.logger.info('Device has no ai channels')
+            return None
+        return await self.client.write_multiple_coils(595, [bool(m) for m in masks])
+
+    async def ai_write_ranges(self, data):
+        if self.ai_n <= 0:
+            self.logger.info('Device has no ai channels')
+            return None
+        return await self.client.write_multiple_registers(427, [int(m) for m in data])
+
+    # AO functions
+    async def ao_read_n(self):
+        if not self.is_open:
+            return 0
+        return await self._read_first(self.client.read_input_registers, (330, 130))
+
+    async def ao_read_ranges(self):
+        if self.ao_n <= 0:
+            return None
+        regs = await self.client.read_holding_registers(459, self.ao_n)
+        if regs and len(regs) == self.ao_n:
+            return regs
+        return [0xff] * self.ao_n
+
+    async def ao_read(self, channel=None):
+        if channel is not None:
+            return await self.ao_read_channel(channel)
+        if self.ao_n <= 0:
+            self.logger.info('Device has no ao channels')
+            return None
+        regs = await self.client.read_holding_registers(0, self.ao_n)
+        if regs and len(regs) == self.ao_n:
+            return self.ao_table.values(regs).tolist()
+        return [NaN] * self.ao_n
+
+    async def ao_read_channel(self, k: int):
+        if self.ao_n <= 0:
+            self.logger.info('Device has no ao channels')
+            return None
+        regs = await self.client.read_holding_registers(k, 1)
+        if not regs:
+            return None
+        v = self.ao_table.value(k, regs[0])
+        if self.ao_correct_output and abs(self.ao_last_written_values[k] - v) <= self.ao_quanta[k]:
+            v = self.ao_last_written_values[k]
+        return v
+
+    async def ao_write(self, values):
+        if self.ao_n <= 0:
+            self.logger.info('Device has no ao channels')
+            return False
+        if len(values) != self.ao_n:
+            return False
+        values = [float(v) for v in values]
+        regs = self.ao_table.codes(values).tolist()
+        if await self.client.write_multiple_registers(0, regs):
+            self.ao_last_written_values[:] = values
+            return True
+        return False
+
+    async def ao_write_channel(self, k: int, value):
+        if self.ao_n <= 0:
+            self.logger.info('Device has no ao channels')
+            return False
+        value = float(value)
+        if await self.client.write_single_register(k, self.ao_table.code(k, value)):
+            self.ao_last_written_values[k] = value
+            return True
+        return False
+
+    async def ao_write_ranges(self, data):
+        if self.ao_n <= 0:
+            self.logger.info('Device has no ao channels')
+            return False
+        return await self.client.write_multiple_registers(459, [int(m) for m in data])
+
+    # DI functions
+    async def di_read_n(self):
+        if not self.is_open:
+            return 0
+        return await self._read_first(self.client.read_input_registers, (300, 100))
+
+    async def di_read(self, channel=None):
+        if self.di_n <= 0:
+            self.logger.info('Device has no di channels')
+            return None
+        if channel is not None:
+            return await self.di_read_channel(channel)
+        regs = await self.client.read_discrete_inputs(0, self.di_n)
+        if regs and len(regs) == self.di_n:
+            return regs
+        return [None] * self.di_n
+
+    async def di_read_channel(self, k: int):
+        if self.di_n <= 0:
+            self.logger.info('Device has no di channels')
+            return None
+        reg = await self.client.read_discrete_inputs(k, 1)
+        if reg:
+            return reg[0]
+        return None
+
+    # DO functions
+    async def do_read_n(self):
+        if not self.is_open:
+            return 0
+        return await self._read_first(self.client.read_input_registers, (310, 110))
+
+    async def do_read(self, channel=None):
+        if self.do_n <= 0:
+            self.logger.info('Device has no do channels')
+            return None
+        if channel is not None:
+            return await self.do_read_channel(channel)
+        regs = await self.client.read_coils(0, self.do_n)
+        if regs and len(regs) == self.do_n:
+            return regs
+        return [None] * self.do_n
+
+    async def do_read_channel(self, k: int):
+        if self.do_n <= 0:
+            self.logger.info('Device has no do channels')
+            return None
+        reg = await self.client.read_coils(k, 1)
+        if reg:
+            return reg[0]
+        return None
+
+    async def do_write(self, values):
+        if self.do_n <= 0:
+            self.logger.info('Device has no do channels')
+            return False
+        return bool(await self.client.write_multiple_coils(0, values))
+
+    async def do_write_channel(self, k: int, value: bool):
+        if self.do_n <= 0:
+            self.logger.info('Device has no do channels')
+            return False
+        return bool(await self.client.write_single_coil(k, value))
+
+    async def read_modbus(self, addr, n):
+        if not self.is_open:
+            return 0
+        if addr >= 40000:
+            return await self.client.read_holding_registers(addr - 40000, n)
+        if addr >= 30000:
+            return await self.client.read_input_registers(addr - 30000, n)
+        if addr >= 20000:
+            self.logger.debug('ModBus address out of range')
+            return None
+        if addr >= 10000:
+            return await self.client.read_discrete_inputs(addr - 10000, n)
+        if addr >= 0:
+            return await self.client.read_coils(addr, n)
+        return None
+
+    async def write_modbus(self, addr, v):
+        if not self.is_open:
+            return 0
+        if addr >= 40000:
+            return await self.client.write_multiple_registers(addr - 40000, v)
+        if 10000 <= addr or addr < 0:
+            self.logger.debug('ModBus address out of range')
+            return False
+        return await self.client.write_multiple_coils(addr, v)
+
+
+if __name__ == "__main__":
+    # read all inputs of several devices concurrently
+    async def main(hosts):
+        devices = await asyncio.gather(*[AsyncET7000.connect(h) for h in hosts])
+        for et in devices:
+            print('PET%s at %s' % (et.type_str, et.host))
+        results = await asyncio.gather(*[et.ai_read() for et in devices])
+        for et, v in zip(devices, results):
+            print(et.host, v)
+        await asyncio.gather(*[et.close() for et in devices])
+
+    asyncio.run(main(sys.argv[1:] or ['192.168.1.108']))
@@ -2,29 +2,39 @@
 import os, sys
 if os.path.realpath('../TangoUtils') not in sys.path: sys.path.append(os.path.realpath('../TangoUtils'))
 
+import json
+import tempfile
 import time
+from array import array
 from math import sin
+from threading import Lock, Thread
 
-from pyModbusTCP.client import ModbusClient
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
 
 from config_logger import config_logger
 from log_exception import log_exception
+from ModbusTransport import ModbusWorker, PRIORITY_SCAN, pack_mask, plan_reads, request_priority, unpack_mask
+from RingBuffer import RingBuffer
+from WriteCoalescer import WriteCoalescer
 
 NaN = float('nan')
 
 
-class ModifiedModbusClient(ModbusClient):
-    def _send_mbus(self, arg):
-        result = super()._send_mbus(arg)
-        # after sending request sleep for 5 ms
-        # (average time to get response from device is 20 ms)
-        # for thread scheduler has an opportunity
-        # to switch to another thread in multithread application
-        time.sleep(0.005)
-        return result
-
-
 class ET7000:
+    # modbus read functions and addresses for ai, ao, di, do banks
+    bank_read_functions = {
+        'ai': 'read_input_registers',
+        'ao': 'read_holding_registers',
+        'di': 'read_discrete_inputs',
+        'do': 'read_coils'
+    }
+    bit_banks = ('di', 'do')
+    output_banks = ('ao', 'do')
     ranges = {
         0x00: {
             'min': -0.015,
@@ -411,8 +421,23 @@ class ET7000:
         self.port = port
         self.timeout = timeout
         self.ao_correct_output = kwargs.pop('ao_correct_output', True)
+        # max age of scan snapshot for channel reads, 0.0 - read every channel from device
+        self.max_age = kwargs.pop('max_age', 0.0)
+        # outputs are cached write-through and read back from device with this period,
+        # 0.0 - outputs are read like inputs
+        self.output_readback = kwargs.pop('output_readback', 0.0)
         # LOGGER config
-        self.logger = kwargs.pop('logger', config_logger())
+        self.logger = kwargs.pop('logger', None) or config_logger()
+        # device configuration cache, file name or MetadataCache
+        self.metadata_cache = kwargs.pop('metadata_cache', None)
+        if isinstance(self.metadata_cache, str):
+            self.metadata_cache = MetadataCache.get(self.metadata_cache)
+        # max age in seconds of cached configuration, None - cache never expires
+        self.metadata_max_age = kwargs.pop('metadata_max_age', None)
+        # time of the last configuration read from device, 0.0 - configuration is from cache
+        self.discovery_time = 0.0
+        # unused addresses between requested ones read by one request in read_modbus_multi
+        self.read_gap = kwargs.pop('read_gap', 8)
         # defaults
         self.type = 0
         self.type_str = '0000'
@@ -435,9 +460,17 @@ class ET7000:
         self.di_n = 0
         # default do
         self.do_n = 0
+        # scan snapshot: raw data of ai, ao, di, do banks and time of reading
+        self.snapshot = {'ai': None, 'ao': None, 'di': None, 'do': None}
+        self.snapshot_time = {'ai': 0.0, 'ao': 0.0, 'di': 0.0, 'do': 0.0}
+        # continuous ai acquisition: raw codes ring buffer and reader thread
+        self.acquisition = None
+        self.acquisition_thread = None
+        self.acquiring = False
+        self.acquisition_errors = 0
         # modbus client
         if client is None:
-            self.client = ModifiedModbusClient(host, port, auto_open=True, auto_close=False, timeout=timeout)
+            self.client = ModbusWorker(host, port, auto_open=True, auto_close=False, timeout=timeout)
         else:
             self.client = client
         self.is_open = self.client.open()
@@ -447,46 +480,98 @@ class ET7000:
         # read module type
         self.type = self.read_module_type()
         self.type_str = hex(self.type).replace('0x', '')
+        # configuration from cache if module type matches, else read from device
+        if not self.load_metadata():
+            self.discover()
+        self.logger.debug('ET-%s at %s has been created' % (self.type_str, host))
+
+    def discover(self):
+        # read device configuration
         # ai
         self.ai_n = self.ai_read_n()
         self.ai_masks = self.ai_read_masks()
         self.ai_ranges = self.ai_read_ranges()
-        self.ai_units = [''] * self.ai_n
-        self.ai_convert = [lambda x: x] * self.ai_n
-        self.ai_min = [0.0] * self.ai_n
-        self.ai_max = [0.0] * self.ai_n
-        for i in range(self.ai_n):
-            r = self.ai_ranges[i]
-            self.ai_units[i] = ET7000.ranges[r]['units']
-            self.ai_min[i] = ET7000.ranges[r]['min']
-            self.ai_max[i] = ET7000.ranges[r]['max']
-            self.ai_convert[i] = ET7000.ai_convert_function(r)
+        self.configure_ai()
         # ao
         self.ao_n = self.ao_read_n()
         self.ao_masks = self.ao_read_masks()
         self.ao_ranges = self.ao_read_ranges()
-        self.ao_units = [''] * self.ao_n
-        self.ao_min = [0.0] * self.ao_n
-        self.ao_max = [0.0] * self.ao_n
-        self.ao_convert = [lambda x: x] * self.ao_n
-        self.ao_convert_write = [lambda x: 0] * self.ao_n
-        self.ao_quanta = [0.0] * self.ao_n
-        for i in range(self.ao_n):
-            r = self.ai_ranges[i]
-            self.ao_units[i] = ET7000.ranges[r]['units']
-            self.ao_min[i] = ET7000.ranges[r]['min']
-            self.ao_max[i] = ET7000.ranges[r]['max']
-            self.ao_convert[i] = ET7000.ai_convert_function(r)  # !!! ao_convert for reading
-            self.ao_convert_write[i] = ET7000.ao_convert_function(r)  # !!! ao_convert for writing
-            self.ao_quanta[i] = abs(self.ao_convert[i](1) - self.ao_convert[i](0))
-        self.ao_last_written_values = [0.0] * self.ao_n
+        self.configure_ao()
         # di
         self.di_n = self.di_read_n()
         # do
         self.do_n = self.do_read_n()
-        self.logger.debug('ET-%s at %s has been created' % (self.type_str, host))
+        self.discovery_time = time.time()
+        self.save_metadata()
+
+    def metadata_key(self):
+        return '%s:%s' % (self.host, self.port)
+
+    def load_metadata(self):
+        if self.metadata_cache is None or self.type == 0:
+            return False
+        data = self.metadata_cache.read(self.metadata_key())
+        if not data or data.get('type') != self.type:
+            return False
+        if self.metadata_max_age is not None and time.time() - data.get('time', 0.0) > self.metadata_max_age:
+            return False
+        try:
+            self.ai_n = data['ai_n']
+            self.ai_masks = [bool(m) for m in data['ai_masks']]
+            self.ai_ranges = data['ai_ranges']
+            self.configure_ai()
+            self.ao_n = data['ao_n']
+            self.ao_masks = [True] * self.ao_n
+            self.ao_ranges = data['ao_ranges']
+            self.configure_ao()
+            self.di_n = data['di_n']
+            self.do_n = data['do_n']
+        except KeyboardInterrupt:
+            raise
+        except:
+            self.logger.info('Wrong cached configuration for %s' % self.metadata_key())
+            return False
+        return True
+
+    def save_metadata(self):
+        if self.metadata_cache is None or self.type == 0:
+            return False
+        data = {'type': self.type,
+                'time': time.time(),
+                'ai_n': self.ai_n,
+                'ai_masks': [bool(m) for m in self.ai_masks],
+                'ai_ranges': list(self.ai_ranges),
+                'ao_n': self.ao_n,
+                'ao_ranges': list(self.ao_ranges) if self.ao_ranges else [],
+                'di_n': self.di_n,
+                'do_n': self.do_n}
+        return self.metadata_cache.write(self.metadata_key(), data)
+
+    def configure_ai(self):
+        # units, limits and conversion table for ai channels from ai_ranges
+        self.ai_table = ConversionTable(self.ai_ranges, self.ai_masks)
+        self.ai_units = [ET7000.range(r)['units'] for r in self.ai_ranges]
+        self.ai_min = self.ai_table.v_min.tolist()
+        self.ai_max = self.ai_table.v_max.tolist()
+
+    def configure_ao(self):
+        # units, limits and conversion table for ao channels
+        # !!! ao uses ai ranges, ao ranges only for channels without ai
+        ranges = [self.ai_ranges[i] if i < len(self.ai_ranges) else self.ao_ranges[i] for i in range(self.ao_n)]
+        self.ao_table = ConversionTable(ranges)
+        self.ao_table_ranges = ranges
+        self.ao_units = [ET7000.range(r)['units'] for r in ranges]
+        self.ao_min = self.ao_table.v_min.tolist()
+        self.ao_max = self.ao_table.v_max.tolist()
+        self.ao_quanta = self.ao_table.quanta().tolist()
+        self.ao_last_written_values = [0.0] * self.ao_n
+
+    @staticmethod
+    def range(r):
+        return ET7000.ranges.get(r, ET7000.ranges[0xff])
 
     def __del__(self):
+        self.acquiring = False
         try:
             self.client.close()
         except KeyboardInterrupt:
@@ -553,6 +638,185 @@ class ET7000:
             return regs[0]
         return 0
 
+    # Scan snapshot functions
+    def _is_fresh(self, bank: str, max_age):
+        if bank in ET7000.output_banks:
+            max_age = max(max_age, self.output_readback)
+        return self.snapshot[bank] is not None and max_age > 0.0 and \
+            time.time() - self.snapshot_time[bank] <= max_age
+
+    def _write_through(self, bank: str, first: int, data):
+        # put successfully written outputs to snapshot, time of readback is kept
+        n = getattr(self, bank + '_n')
+        old = self.snapshot[bank]
+        if old is None:
+            if first != 0 or len(data) != n:
+                return
+            self.snapshot_time[bank] = time.time()
+            old = 0 if bank in ET7000.bit_banks else (0,) * n
+        if bank in ET7000.bit_banks:
+            span = ((1 << len(data)) - 1) << first
+            self.snapshot[bank] = (old & ~span) | (pack_mask(data) << first)
+        else:
+            regs = list(old)
+            regs[first:first + len(data)] = data
+            self.snapshot[bank] = tuple(regs)
+
+    def _bank_request(self, bank: str):
+        # (client method, address, count) to read whole bank, di and do banks are read as packed int
+        name = ET7000.bank_read_functions[bank]
+        if bank in ET7000.bit_banks and hasattr(self.client, name + '_packed'):
+            name += '_packed'
+        return name, 0, getattr(self, bank + '_n')
+
+    def _store_bank(self, bank: str, regs):
+        # ai and ao banks are stored as tuple of codes, di and do as int bitmask
+        n = getattr(self, bank + '_n')
+        data = None
+        if bank in ET7000.bit_banks and isinstance(regs, int):
+            data = regs
+        elif regs and len(regs) == n:
+            data = pack_mask(regs) if bank in ET7000.bit_banks else tuple(regs)
+        self.snapshot[bank] = data
+        self.snapshot_time[bank] = 0.0 if data is None else time.time()
+        return data
+
+    def read_bank(self, bank: str, max_age=None):
+        # raw data of the whole bank 'ai', 'ao', 'di' or 'do' by one modbus transaction,
+        # served from snapshot if it is not older than max_age
+        if max_age is None:
+            max_age = self.max_age
+        n = getattr(self, bank + '_n')
+        if n <= 0:
+            return None
+        if self._is_fresh(bank, max_age):
+            return self.snapshot[bank]
+        name, addr, n = self._bank_request(bank)
+        return self._store_bank(bank, getattr(self.client, name)(addr, n))
+
+    def scan(self, max_age=0.0, banks=None):
+        # refresh all banks, or only listed ones, older than max_age, one transaction per bank,
+        # requests are pipelined if client supports batch()
+        banks = [b for b in (ET7000.bank_read_functions if banks is None else banks)
+                 if getattr(self, b + '_n') > 0 and not self._is_fresh(b, max_age)]
+        results = self._client_calls([self._bank_request(b) for b in banks])
+        for bank, regs in zip(banks, results):
+            self._store_bank(bank, regs)
+        return self.snapshot
+
+    @staticmethod
+    def _contiguous_runs(channels):
+        # [first, count] of runs of consecutive channels
+        runs = []
+        for k in sorted(channels):
+            if runs and runs[-1][0] + runs[-1][1] == k:
+                runs[-1][1] += 1
+            else:
+                runs.append([k, 1])
+        return runs
+
+    def _client_calls(self, calls):
+        # results of calls (client method, address, count or values), pipelined if client supports batch()
+        if hasattr(self.client, 'batch'):
+            return self.client.batch(calls)
+        return [getattr(self.client, c[0])(c[1], c[2]) for c in calls]
+
+    def snapshot_values(self, bank: str):
+        # values of bank from current snapshot without io, None if bank was not read
+        data = self.snapshot[bank]
+        if data is None:
+            return None
+        if bank == 'ai':
+            return self._ai_values(data)
+        if bank == 'ao':
+            return self._ao_values(data)
+        return unpack_mask(data, getattr(self, bank + '_n'))
+
+    def read_all(self):
+        # values of ai, ao, di and do banks read together in about one round trip
+        snapshot = self.scan(self.max_age)
+        result = {}
+        if self.ai_n > 0:
+            result['ai'] = self._ai_values(snapshot['ai'])
+        if self.ao_n > 0:
+            result['ao'] = self._ao_values(snapshot['ao'])
+        for bank in ET7000.bit_banks:
+            n = getattr(self, bank + '_n')
+            if n > 0:
+                mask = snapshot[bank]
+                result[bank] = [None] * n if mask is None else unpack_mask(mask, n)
+        return result
+
+    def invalidate_snapshot(self, bank=None):
+        banks = ET7000.bank_read_functions if bank is None else (bank,)
+        for b in banks:
+            self.snapshot_time[b] = 0.0
+
+    def _read_channel_raw(self, bank: str, k: int):
+        if self.max_age > 0.0 or (bank in ET7000.output_banks and self.output_readback > 0.0):
+            data = self.read_bank(bank)
+            if data is None:
+                return None
+            if bank in ET7000.bit_banks:
+                return bool((data >> k) & 1)
+            return data[k]
+        regs = getattr(self.client, ET7000.bank_read_functions[bank])(k, 1)
+        if regs:
+            return regs[0]
+        return None
+
+    # Continuous acquisition functions
+    def start_acquisition(self, capacity=10000):
+        # read ai bank back-to-back in dedicated thread into ring buffer of raw codes
+        if self.ai_n <= 0:
+            self.logger.info('Device has no ai channels')
+            return False
+        self.stop_acquisition()
+        self.acquisition = RingBuffer(capacity, self.ai_n, np.uint16)
+        self.acquisition_errors = 0
+        self.acquiring = True
+        self.acquisition_thread = Thread(target=self._acquire, name='ET%s acquisition' % self.type_str, daemon=True)
+        self.acquisition_thread.start()
+        return True
+
+    def stop_acquisition(self):
+        self.acquiring = False
+        if self.acquisition_thread is not None:
+            self.acquisition_thread.join()
+            self.acquisition_thread = None
+
+    def _acquire(self):
+        # acquisition requests have background scan priority
+        with request_priority(PRIORITY_SCAN):
+            while self.acquiring:
+                try:
+                    regs = self.client.read_input_registers(0, self.ai_n)
+                    t = time.monotonic()
+                    if regs and len(regs) == self.ai_n:
+                        self.acquisition.append(regs, t)
+                        self._store_bank('ai', regs)
+                        continue
+                except KeyboardInterrupt:
+                    raise
+                except:
+                    log_exception(self.logger, 'Acquisition read exception')
+                self.acquisition_errors += 1
+                # do not spin on dead device, transport reconnects on next request
+                time.sleep(self.timeout)
+
+    def acquisition_values(self, n=None):
+        # (monotonic times, values) of the last n samples, values array is samples x channels
+        if self.acquisition is None:
+            return np.zeros(0), np.zeros((0, self.ai_n))
+        times, codes = self.acquisition.latest(n)
+        return times, self.ai_table.values(codes)
+
+    def acquisition_rate(self, n=None):
+        # effective sample rate over the last n samples, Hz
+        if self.acquisition is None or not self.acquiring:
+            return 0.0
+        return self.acquisition.rate(n)
+
     # AI functions
     def ai_read_n(self):
         if not self.is_open:
@@ -591,15 +855,11 @@ class ET7000:
         if self.ai_n <= 0:
             self.logger.info('Device has no ai channels')
             return None
-        result = self.client.read_input_registers(0, self.ai_n)
-        if result and len(result) == self.ai_n:
-            for i in range(self.ai_n):
-                if self.ai_masks[i]:
-                    result[i] = self.ai_convert[i](result[i])
-                else:
-                    self.logger.info('Read for masked ai channel %s ignored' % i)
-                    result[i] = NaN
-            return result
+        return self._ai_values(self.read_bank('ai'))
+
+    def _ai_values(self, regs):
+        if regs:
+            return self.ai_table.values(regs).tolist()
         else:
             self.logger.info('Error reading channels')
             return [NaN] * self.ai_n
@@ -610,9 +870,9 @@ class ET7000:
             return None
         try:
             if self.ai_masks[channel]:
-                regs = self.client.read_input_registers(channel, 1)
-                if regs:
-                    return self.ai_convert[channel](regs[0])
+                reg = self._read_channel_raw('ai', channel)
+                if reg is not None:
+                    return self.ai_table.value(channel, reg)
                 else:
                     self.logger.info('Error reading channel')
                     return None
@@ -629,13 +889,24 @@ class ET7000:
         if self.ai_n <= 0:
             self.logger.info('Device has no ai channels')
             return None
-        return self.client.write_multiple_coils(595, [bool(m) for m in masks])
+        result = self.client.write_multiple_coils(595, [bool(m) for m in masks])
+        if result:
+            self.ai_masks = [bool(m) for m in masks]
+            self.configure_ai()
+            self.save_metadata()
+        return result
 
     def ai_write_ranges(self, data):
         if self.ai_n <= 0:
             self.logger.info('Device has no ai channels')
             return None
-        return self.client.write_multiple_registers(427, [int(m) for m in data])
+        result = self.client.write_multiple_registers(427, [int(m) for m in data])
+        if result:
+            self.ai_ranges = [int(m) for m in data]
+            self.configure_ai()
+            self.configure_ao()
+            self.save_metadata()
+        return result
 
     # AO functions
     def ao_read_n(self):
@@ -666,13 +937,12 @@ class ET7000:
         if self.ao_n <= 0:
             self.logger.info('Device has no ao channels')
             return None
-        regs = self.client.read_holding_registers(0, self.ao_n)
-        if regs and len(regs) == self.ao_n:
-            for k in range(self.ao_n):
-                regs[k] = self.ao_convert[k](regs[k])
-        else:
-            regs = [NaN] * self.ao_n
-        return regs
+        return self._ao_values(self.read_bank('ao'))
+
+    def _ao_values(self, regs):
+        if regs:
+            return self.ao_table.values(regs).tolist()
+        return [NaN] * self.ao_n
 
     def ao_read_channel(self, k: int):
         if self.ao_n <= 0:
@@ -681,9 +951,9 @@ class ET7000:
         v = None
         try:
             if self.ao_masks[k]:
-                regs = self.client.read_holding_registers(k, 1)
-                if regs:
-                    v = self.ao_convert[k](regs[0])
+                reg = self._read_channel_raw('ao', k)
+                if reg is not None:
+                    v = self.ao_table.value(k, reg)
                     if self.ao_correct_output:
                         if abs(self.ao_last_written_values[k] - v) <= self.ao_quanta[k]:
                             v = self.ao_last_written_values[k]
@@ -700,34 +970,71 @@ class ET7000:
         n = len(values)
         if n != self.ao_n:
             return False
-        regs = [0] * n
-        for i in range(n):
-            values[i] = float(values[i])
-            regs[i] = self.ao_convert_write[i](values[i])
+        values = [float(v) for v in values]
+        regs = self.ao_table.codes(values).tolist()
         result = self.client.write_multiple_registers(0, regs)
-        if result:
-            for i in range(n):
-                self.ao_last_written_values[i] = values[i]
-            return True
-        return False
+        if not result:
+            self.invalidate_snapshot('ao')
+            return False
+        self._write_through('ao', 0, regs)
+        for i in range(n):
+            self.ao_last_written_values[i] = values[i]
+        return True
 
     def ao_write_channel(self, k: int, value):
         if self.ao_n <= 0:
             self.logger.info('Device has no ao channels')
             return False
         value = float(value)
-        raw = self.ao_convert_write[k](value)
+        raw = self.ao_table.code(k, value)
         result = self.client.write_single_register(k, raw)
-        if result:
-            self.ao_last_written_values[k] = value
-            return True
-        return False
+        if not result:
+            self.invalidate_snapshot('ao')
+            return False
+        self._write_through('ao', k, [raw])
+        self.ao_last_written_values[k] = value
+        return True
+
+    def ao_write_channels(self, values: dict):
+        # write {channel: value}, one transaction for every run of consecutive channels,
+        # transactions are pipelined, channels missing in values are not touched.
+        # Returns {channel: success}, every channel gets result of its own transaction
+        if self.ao_n <= 0:
+            self.logger.info('Device has no ao channels')
+            return {k: False for k in values}
+        if not values:
+            return {}
+        if min(values) < 0 or max(values) >= self.ao_n:
+            return {k: False for k in values}
+        if len(values) == 1:
+            k = next(iter(values))
+            return {k: bool(self.ao_write_channel(k, values[k]))}
+        values = {k: float(v) for k, v in values.items()}
+        calls = [('write_multiple_registers', first,
+                  [self.ao_table.code(k, values[k]) for k in range(first, first + n)])
+                 for first, n in self._contiguous_runs(values)]
+        success = {}
+        for (name, first, codes), result in zip(calls, self._client_calls(calls)):
+            for k in range(first, first + len(codes)):
+                success[k] = bool(result)
+            if not result:
+                self.invalidate_snapshot('ao')
+                continue
+            self._write_through('ao', first, codes)
+            for k in range(first, first + len(codes)):
+                self.ao_last_written_values[k] = values[k]
+        return success
 
     def ao_write_ranges(self, data):
         if self.ao_n <= 0:
             self.logger.info('Device has no ao channels')
             return False
-        return self.client.write_multiple_registers(459, [int(m) for m in data])
+        result = self.client.write_multiple_registers(459, [int(m) for m in data])
+        if result:
+            self.ao_ranges = [int(m) for m in data]
+            self.configure_ao()
+            self.save_metadata()
+        return result
 
     # DI functions
     def di_read_n(self):
@@ -747,19 +1054,23 @@ class ET7000:
             return None
         if channel is not None:
             return self.di_read_channel(channel)
-        regs = self.client.read_discrete_inputs(0, self.di_n)
-        if regs and len(regs) == self.di_n:
-            return regs
+        mask = self.read_bank('di')
+        if mask is not None:
+            return unpack_mask(mask, self.di_n)
         return [None] * self.di_n
 
+    def di_read_mask(self):
+        # all di channels as int, bit k is channel k, None on error
+        if self.di_n <= 0:
+            self.logger.info('Device has no di channels')
+            return None
+        return self.read_bank('di')
+
     def di_read_channel(self, k: int):
         if self.di_n <= 0:
             self.logger.info('Device has no di channels')
             return None
-        reg = self.client.read_discrete_inputs(k, 1)
-        if reg:
-            return reg[0]
-        return None
+        return self._read_channel_raw('di', k)
 
     # DO functions
     def do_read_n(self):
@@ -779,37 +1090,74 @@ class ET7000:
             return None
         if channel is not None:
             return self.do_read_channel(channel)
-        regs = self.client.read_coils(0, self.do_n)
-        if regs and len(regs) == self.do_n:
-            return regs
+        mask = self.read_bank('do')
+        if mask is not None:
+            return unpack_mask(mask, self.do_n)
         return [None] * self.do_n
 
+    def do_read_mask(self):
+        # all do channels as int, bit k is channel k, None on error
+        if self.do_n <= 0:
+            self.logger.info('Device has no do channels')
+            return None
+        return self.read_bank('do')
+
+    def do_write_mask(self, mask: int):
+        return self.do_write(unpack_mask(mask, self.do_n))
+
     def do_read_channel(self, k: int):
         if self.do_n <= 0:
             self.logger.info('Device has no do channels')
             return None
-        reg = self.client.read_coils(0 + k, 1)
-        if reg:
-            return reg[0]
-        return None
+        return self._read_channel_raw('do', k)
 
     def do_write(self, values):
         if self.do_n <= 0:
             self.logger.info('Device has no do channels')
             return False
         result = self.client.write_multiple_coils(0, values)
-        if result:
-            return True
-        return False
+        if not result:
+            self.invalidate_snapshot('do')
+            return False
+        self._write_through('do', 0, values)
+        return True
 
     def do_write_channel(self, k: int, value: bool):
         if self.do_n <= 0:
             self.logger.info('Device has no do channels')
             return False
         result = self.client.write_single_coil(0 + k, value)
-        if result:
-            return result
-        return False
+        if not result:
+            self.invalidate_snapshot('do')
+            return False
+        self._write_through('do', k, [value])
+        return result
+
+    def do_write_channels(self, values: dict):
+        # write {channel: value}, one transaction for every run of consecutive channels,
+        # transactions are pipelined, channels missing in values are not touched.
+        # Returns {channel: success}, every channel gets result of its own transaction
+        if self.do_n <= 0:
+            self.logger.info('Device has no do channels')
+            return {k: False for k in values}
+        if not values:
+            return {}
+        if min(values) < 0 or max(values) >= self.do_n:
+            return {k: False for k in values}
+        if len(values) == 1:
+            k = next(iter(values))
+            return {k: bool(self.do_write_channel(k, values[k]))}
+        calls = [('write_multiple_coils', first, [bool(values[k]) for k in range(first, first + n)])
+                 for first, n in self._contiguous_runs(values)]
+        success = {}
+        for (name, first, bits), result in zip(calls, self._client_calls(calls)):
+            for k in range(first, first + len(bits)):
+                success[k] = bool(result)
+            if not result:
+                self.invalidate_snapshot('do')
+                continue
+            self._write_through('do', first, bits)
+        return success
 
     def read_modbus(self, addr, n):
         if not self.is_open:
@@ -827,6 +1175,34 @@ class ET7000:
             return self.client.read_coils(addr, n)
         return None
 
+    def read_modbus_multi(self, addresses, gap=None):
+        # values of addresses in 0/10000/30000/40000 notation read by the fewest transactions,
+        # dict address: value, None for addresses which were not read
+        result = dict.fromkeys(addresses)
+        if not self.is_open or not addresses:
+            return result
+        plan = plan_reads(addresses, self.read_gap if gap is None else gap)
+        failed = []
+        for request, regs in zip(plan, self._client_calls([(p[0], p[2], p[3]) for p in plan])):
+            if regs:
+                self._store_plan_result(result, request, regs)
+            else:
+                failed.append(request)
+        # device may reject request spanning unused addresses, they are read again without gaps
+        wanted = [a for a in result if any(p[1] + p[2] <= a < p[1] + p[2] + p[3] for p in failed)]
+        plan = [p for p in plan_reads(wanted, 0) if p not in failed]
+        for request, regs in zip(plan, self._client_calls([(p[0], p[2], p[3]) for p in plan])):
+            if regs:
+                self._store_plan_result(result, request, regs)
+        return result
+
+    @staticmethod
+    def _store_plan_result(result: dict, request, regs):
+        name, table, first, n = request
+        for k in range(min(n, len(regs))):
+            if table + first + k in result:
+                result[table + first + k] = regs[k]
+
     def write_modbus(self, addr, v):
         if not self.is_open:
             return 0
@@ -845,6 +1221,13 @@ class ET7000:
             return self.client.write_multiple_coils(addr, v)
         return False
 
+    def is_connected(self) -> bool:
+        # no io, True if device was recognized and connection was not closed after error
+        is_open = getattr(self.client, 'is_open', True)
+        if callable(is_open):
+            is_open = is_open()
+        return bool(self.is_open and is_open and self.type != 0)
+
     def print_connection_state(self) -> bool:
         if self.type == 0:
             print('PET70xx not found at %s' % self.host)
@@ -854,55 +1237,321 @@ class ET7000:
             return True
 
 
+# device configurations stored in json file, one instance per file in the process.
+# Relative file names are resolved against directory of this module, not current directory.
+# Several processes may share the file: writes are serialized by lock file and merged with file contents
+class MetadataCache:
+    instances = {}
+    instances_lock = Lock()
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.lock = Lock()
+        self.data = None
+
+    @staticmethod
+    def get(file_name: str):
+        with MetadataCache.instances_lock:
+            if not os.path.isabs(file_name):
+                file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
+            key = os.path.abspath(file_name)
+            if key not in MetadataCache.instances:
+                MetadataCache.instances[key] = MetadataCache(key)
+            return MetadataCache.instances[key]
+
+    def _read_file(self):
+        try:
+            with open(self.file_name, 'r') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                return data
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def _load(self):
+        if self.data is None:
+            self.data = self._read_file()
+        return self.data
+
+    def _lock_file(self, f, lock: bool):
+        # exclusive lock between processes
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if lock else fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if lock else msvcrt.LK_UNLCK, 1)
+
+    def read(self, key: str):
+        with self.lock:
+            return self._load().get(key)
+
+    def write(self, key: str, value: dict):
+        with self.lock:
+            tmp = None
+            try:
+                with open(self.file_name + '.lock', 'a') as lock_file:
+                    self._lock_file(lock_file, True)
+                    try:
+                        # only this entry is changed, entries written by other processes are kept
+                        data = self._read_file()
+                        data[key] = value
+                        # write to unique temporary file and replace atomically
+                        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.file_name) + '.',
+                                                   suffix='.tmp', dir=os.path.dirname(self.file_name))
+                        with os.fdopen(fd, 'w') as f:
+                            json.dump(data, f)
+                        os.replace(tmp, self.file_name)
+                        tmp = None
+                        self.data = data
+                    finally:
+                        self._lock_file(lock_file, False)
+                return True
+            except OSError:
+                log_exception(config_logger(), 'Can not write metadata cache %s' % self.file_name)
+                if tmp is not None:
+                    try:
+                        os.remove(tmp)
+                    except OSError:
+                        pass
+                return False
+
+
+# Process-wide drivers keyed by (host, port) shared by all users of one module.
+# Module accepts only a few modbus tcp connections, so all users ride one connection and one scan snapshot.
+class DriverRegistry:
+    lock = Lock()
+    # (host, port) -> [driver, number of users, {bank: WriteCoalescer}]
+    entries = {}
+
+    @staticmethod
+    def acquire(host: str, port=502, factory=None, **kwargs):
+        # shared driver for module, created by factory(host, port=port, **kwargs) if there is no usable one.
+        # kwargs of the first user are used, release() the driver when it is not needed
+        key = (host, port)
+        with DriverRegistry.lock:
+            entry = DriverRegistry.entries.get(key)
+            if entry is not None and entry[0].type != 0:
+                entry[1] += 1
+                return entry[0]
+        driver = (factory or ET7000)(host, port=port, **kwargs)
+        with DriverRegistry.lock:
+            entry = DriverRegistry.entries.get(key)
+            if entry is None or entry[0].type == 0:
+                # new or replacing never discovered driver, its users close it on release
+                DriverRegistry.entries[key] = [driver, 1, {}]
+                return driver
+            # created concurrently by another user
+            entry[1] += 1
+        driver.__del__()
+        return entry[0]
+
+    @staticmethod
+    def release(driver):
+        key = (driver.host, driver.port)
+        with DriverRegistry.lock:
+            entry = DriverRegistry.entries.get(key)
+            if entry is not None and entry[0] is driver:
+                entry[1] -= 1
+                if entry[1] > 0:
+                    return
+                del DriverRegistry.entries[key]
+        driver.__del__()
+
+    @staticmethod
+    def writer(driver, bank: str, window: float, logger=None):
+        # coalescer of 'ao' or 'do' channel writes shared by all users of driver, so writes
+        # of devices pointing to one module are merged, window of the first user is used.
+        # Driver not in registry gets its own coalescer
+        with DriverRegistry.lock:
+            entry = DriverRegistry.entries.get((driver.host, driver.port))
+            writers = entry[2] if entry is not None and entry[0] is driver else {}
+            if bank not in writers:
+                writers[bank] = WriteCoalescer(getattr(driver, bank + '_write_channels'), window, logger=logger)
+            return writers[bank]
+
+    @staticmethod
+    def users(driver):
+        with DriverRegistry.lock:
+            entry = DriverRegistry.entries.get((driver.host, driver.port))
+            if entry is not None and entry[0] is driver:
+                return entry[1]
+            return 0
+
+
+# gain and offset of ranges compiled to arrays for conversion of whole bank by one vectorized call
+class ConversionTable:
+    def __init__(self, ranges, masks=None):
+        n = len(ranges)
+        self.v_min = np.zeros(n)
+        self.v_max = np.zeros(n)
+        c_min = np.zeros(n)
+        c_max = np.zeros(n)
+        for i, r in enumerate(ranges):
+            d = ET7000.range(r)
+            self.v_min[i] = d['min']
+            self.v_max[i] = d['max']
+            c_min[i] = d['min_code']
+            c_max[i] = d['max_code']
+        # two's complement ranges have min_code > max_code
+        self.bipolar = c_min > c_max
+        self.mask = np.ones(n, dtype=bool) if masks is None else np.array(masks, dtype=bool)
+        uni = ~self.bipolar
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # code -> value: gain for non-negative codes, gain_neg for negative two's complement codes
+            self.gain = np.where(uni, (self.v_max - self.v_min) / (c_max - c_min), self.v_max / c_max)
+            self.gain_neg = np.where(uni, self.gain, -self.v_min / (0x10000 - c_min))
+            self.offset = np.where(uni, self.v_min - self.gain * c_min, 0.0)
+            # value -> code
+            self.w_gain = np.where(uni, (c_max - c_min) / (self.v_max - self.v_min), c_max / self.v_max)
+            self.w_gain_neg = np.where(uni, self.w_gain, (0xffff - c_min) / self.v_min)
+            self.w_offset = np.where(uni, c_min - self.w_gain * self.v_min, 0.0)
+
+    def __len__(self):
+        return len(self.gain)
+
+    def values(self, codes):
+        # array of values for bank of raw 16-bit codes, NaN for masked channels
+        c = np.asarray(codes, dtype=np.int64)
+        c = np.where(self.bipolar & (c >= 0x8000), c - 0x10000, c)
+        v = np.where(c >= 0, self.gain * c, self.gain_neg * c) + self.offset
+        v[..., ~self.mask] = np.nan
+        return v
+
+    def codes(self, values):
+        # array of raw 16-bit codes for bank of values, values are clipped to range
+        v = np.clip(np.asarray(values, dtype=float), self.v_min, self.v_max)
+        uni = np.trunc(self.w_gain * v + self.w_offset)
+        pos = np.floor(self.w_gain * v + 0.5)
+        neg = np.floor(0xffff - self.w_gain_neg * v + 0.5)
+        return np.where(self.bipolar, np.where(v >= 0.0, pos, neg), uni).astype(np.int64)
+
+    def value(self, k: int, code: int):
+        if not self.mask[k]:
+            return NaN
+        if self.bipolar[k] and code >= 0x8000:
+            code -= 0x10000
+        if code >= 0:
+            return float(self.gain[k] * code + self.offset[k])
+        return float(self.gain_neg[k] * code)
+
+    def code(self, k: int, value: float):
+        v = min(max(float(value), self.v_min[k]), self.v_max[k])
+        if not self.bipolar[k]:
+            return int(self.w_gain[k] * v + self.w_offset[k])
+        if v >= 0.0:
+            return int(self.w_gain[k] * v + 0.5)
+        return int(0xffff - self.w_gain_neg[k] * v + 0.5)
+
+    def quanta(self):
+        # value of one least significant bit
+        return np.abs(self.gain)
+
+
+# One modbus address space of emulated device: values in array or bytearray for bits,
+# and flags of defined addresses. Reads touching undefined address return None like device error.
+class RegisterBank:
+    def __init__(self, bits=False):
+        self.bits = bits
+        self.values = bytearray() if bits else array('H')
+        self.defined = bytearray()
+
+    def __len__(self):
+        return len(self.defined)
+
+    def _grow(self, size: int):
+        n = size - len(self.defined)
+        if n > 0:
+            self.values.extend(bytes(n) if self.bits else array('H', bytes(2 * n)))
+            self.defined.extend(bytes(n))
+
+    def is_defined(self, addr: int, n: int):
+        return addr >= 0 and addr + n <= len(self.defined) and self.defined.find(0, addr, addr + n) < 0
+
+    def read(self, addr: int, n: int):
+        if not self.is_defined(addr, n):
+            return None
+        if self.bits:
+            return [b != 0 for b in self.values[addr:addr + n]]
+        return self.values[addr:addr + n].tolist()
+
+    def read_packed(self, addr: int, n: int):
+        # bits as int, bit k is address addr + k
+        if not self.bits or not self.is_defined(addr, n):
+            return None
+        packed = np.packbits(np.frombuffer(self.values, np.uint8, n, addr), bitorder='little')
+        return int.from_bytes(packed.tobytes(), 'little')
+
+    def write(self, addr: int, values):
+        n = len(values)
+        self._grow(addr + n)
+        if self.bits:
+            self.values[addr:addr + n] = bytes(1 if v else 0 for v in values)
+        else:
+            self.values[addr:addr + n] = array('H', [int(v) & 0xFFFF for v in values])
+        self.defined[addr:addr + n] = b'\x01' * n
+        return True
+
+
 # emulate ET7026 device for tests
 class FakeET7000(ET7000):
+    # register maps of emulated modules by type, address is in 0/10000/30000/40000 notation
+    profiles = {
+        '7026': {
+            0: 0, 1: 1,
+            595: True, 596: True, 597: True, 598: True, 599: True, 600: True,
+            10000: 0, 10001: 1,
+            30000: 0, 30001: 1, 30002: 2, 30003: 3, 30004: 4, 30005: 5,
+            30300: 2,
+            30310: 2,
+            30320: 6,
+            30330: 1,
+            40000: 0, 40001: 0, 40002: 0, 40003: 0, 40004: 0, 40005: 0,
+            40427: 4, 40428: 4, 40429: 4, 40430: 4, 40431: 4, 40432: 4,
+            40459: 0x33,
+            40559: 0x7026,
+        },
+        '7015': {
+            595: True, 596: True, 597: True, 598: True, 599: True, 600: True, 601: True,
+            30000: 0, 30001: 1, 30002: 2, 30003: 3, 30004: 4, 30005: 5, 30006: 6,
+            30300: 0,
+            30310: 0,
+            30320: 7,
+            30330: 0,
+            40427: 0x23, 40428: 0x23, 40429: 0x23, 40430: 0x23, 40431: 0x23, 40432: 0x23, 40433: 0x23,
+            40559: 0x7015,
+        },
+    }
+
+    @staticmethod
+    def load_profiles(file_name: str):
+        # add register maps from json file: {"type": {"address": value or list of values, ...}, ...},
+        # list is stored to consecutive addresses starting from address
+        with open(file_name, 'r') as f:
+            data = json.load(f)
+        for module_type, registers in data.items():
+            profile = {}
+            for addr, value in registers.items():
+                addr = int(addr)
+                if isinstance(value, list):
+                    for i, v in enumerate(value):
+                        profile[addr + i] = v
+                else:
+                    profile[addr] = value
+            FakeET7000.profiles[module_type] = profile
+        return list(data)
+
     class _client:
+        prefixes = (0, 10000, 30000, 40000)
+
         def __init__(self, *args, **kwargs):
             self.is_open = False
             self.count = 0
-            self.data = {
-                40559: 0x7026,
-                30320: 6,
-                595: True, 596: True, 597: True, 598: True, 599: True, 600: True,
-                40427: 4, 40428: 4, 40429: 4, 40430: 4, 40431: 4, 40432: 4,
-                30000: 0, 30001: 1, 30002: 2, 30003: 3, 30004: 4, 30005: 5,
-                30330: 1,
-                40459: 0x33,
-                40000: 0, 40001: 0, 40002: 0, 40003: 0, 40004: 0, 40005: 0,
-                30300: 2,
-                30310: 2,
-                10000: 0, 10001: 1,
-                0: 0, 1: 1,
-            }
-            self.data7026 = {
-                0: 0, 1: 1,
-                595: True, 596: True, 597: True, 598: True, 599: True, 600: True,
-                10000: 0, 10001: 1,
-                30000: 0, 30001: 1, 30002: 2, 30003: 3, 30004: 4, 30005: 5,
-                30300: 2,
-                30310: 2,
-                30320: 6,
-                30330: 1,
-                40000: 0, 40001: 0, 40002: 0, 40003: 0, 40004: 0, 40005: 0,
-                40427: 4, 40428: 4, 40429: 4, 40430: 4, 40431: 4, 40432: 4,
-                40459: 0x33,
-                40559: 0x7026,
-            }
-            self.data7015 = {
-                595: True, 596: True, 597: True, 598: True, 599: True, 600: True, 601: True,
-                30000: 0, 30001: 1, 30002: 2, 30003: 3, 30004: 4, 30005: 5, 30006: 6,
-                30300: 0,
-                30310: 0,
-                30320: 7,
-                30330: 0,
-                40427: 0x23, 40428: 0x23, 40429: 0x23, 40430: 0x23, 40431: 0x23, 40432: 0x23, 40433: 0x23,
-                40559: 0x7015,
-            }
-            if 'type' in kwargs:
-                if kwargs['type'] == '7026':
-                    self.data = self.data7026
-                if kwargs['type'] == '7015':
-                    self.data = self.data7015
+            profile = FakeET7000.profiles.get(kwargs.get('type', '7026'), FakeET7000.profiles['7026'])
+            self.banks = {prefix: RegisterBank(bits=prefix < 30000) for prefix in self.prefixes}
+            for addr, value in profile.items():
+                prefix = max(p for p in self.prefixes if p <= addr)
+                self.banks[prefix].write(addr - prefix, [value])
             self.random = 0.0
             if 'random' in kwargs:
                 self.random = kwargs['random']
@@ -920,20 +1569,10 @@ class FakeET7000(ET7000):
             return self.count
 
         def modbus_read(self, prefix, n, m):
-            try:
-                result = []
-                for i in range(m):
-                    result.append(self.data[prefix + n + i])
-                return result
-            except KeyboardInterrupt:
-                raise
-            except:
-                return None
+            return self.banks[prefix].read(n, m)
 
         def modbus_write(self, prefix, n, m, values):
-            for i in range(m):
-                self.data[prefix + n + i] = values[i]
-            return True
+            return self.banks[prefix].write(n, values[:m])
 
         def read_holding_registers(self, n, m):
             return self.modbus_read(40000, n, m)
@@ -959,6 +1598,12 @@ class FakeET7000(ET7000):
         def read_discrete_inputs(self, n, m):
             return self.modbus_read(10000, n, m)
 
+        def read_coils_packed(self, n, m):
+            return self.banks[0].read_packed(n, m)
+
+        def read_discrete_inputs_packed(self, n, m):
+            return self.banks[10000].read_packed(n, m)
+
         def auto_close(self, x):
             return x
 
@@ -972,7 +1617,7 @@ class FakeET7000(ET7000):
 
     def __init__(self, host, port=502, timeout=0.15, logger=None, **kwargs):
         client = FakeET7000._client(**kwargs)
-        super().__init__(host, port=port, timeout=timeout, logger=logger, client=client)
+        super().__init__(host, port=port, timeout=timeout, logger=logger, client=client, **kwargs)
         self.type_str = '-Emulated-' + self.type_str[:4]
         self.logger.debug('%s at %s has been created' % (self.type_str, host))
 
@@ -0,0 +1,200 @@
+import os, sys
+if os.path.realpath('../TangoUtils') not in sys.path: sys.path.append(os.path.realpath('../TangoUtils'))
+
+import argparse
+import json
+import platform
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from ET7000 import ET7000, FakeET7000, ConversionTable
+from ET7000_Simulator import SimulatedModule
+from ModbusTransport import MBAP_SIZE, mbap
+from ScanScheduler import ScanScheduler
+
+# Offline benchmarks of the driver hot paths.
+# Runs against FakeET7000 and against ModbusStandIn, Modbus TCP server on localhost,
+# so the socket level path is measured without real device.
+# Usage: python ET7000_Benchmark.py [--quick] [--output results.json]
+
+
+# Threaded Modbus TCP server with one simulated module, runs without event loop in the benchmark process
+class ModbusStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, module_type='7026'):
+        self.module = SimulatedModule(module_type)
+        self.lock = threading.Lock()
+        super().__init__((host, port), ModbusStandInHandler)
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='ModbusStandIn', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def process(self, pdu: bytes):
+        with self.lock:
+            return self.module.process(pdu)
+
+
+class ModbusStandInHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.request.setsockopt(socketserver.socket.IPPROTO_TCP, socketserver.socket.TCP_NODELAY, 1)
+
+    def recv(self, n):
+        buf = b''
+        while len(buf) < n:
+            data = self.request.recv(n - len(buf))
+            if not data:
+                raise ConnectionError
+            buf += data
+        return buf
+
+    def handle(self):
+        try:
+            while True:
+                tid, pid, length, unit_id = struct.unpack('>HHHB', self.recv(MBAP_SIZE))
+                pdu = self.recv(length - 1)
+                self.request.sendall(mbap(tid, self.server.process(pdu), unit_id))
+        except (ConnectionError, OSError):
+            pass
+
+
+def measure(function, n: int, repeat=3):
+    # best of repeat runs of n calls
+    best = float('inf')
+    for r in range(repeat):
+        t0 = time.perf_counter()
+        for i in range(n):
+            function()
+        best = min(best, time.perf_counter() - t0)
+    return {'n': n, 'time': best, 'us_per_op': best / n * 1e6, 'ops_per_s': n / best if best > 0.0 else 0.0}
+
+
+def bench_reads(et, n):
+    # per channel reads against one block read of the same bank
+    et.max_age = 0.0
+    result = {
+        'ai_read_channel_all': measure(lambda: [et.ai_read_channel(k) for k in range(et.ai_n)], n),
+        'ai_read_block': measure(et.ai_read, n),
+        'do_read_channel_all': measure(lambda: [et.do_read_channel(k) for k in range(et.do_n)], n),
+        'do_read_block': measure(et.do_read, n),
+        'scan': measure(et.scan, n),
+        'read_all': measure(et.read_all, n),
+    }
+    # channel reads served from snapshot
+    et.max_age = 1000.0
+    result['ai_read_channel_snapshot'] = measure(lambda: et.ai_read_channel(0), n)
+    et.max_age = 0.0
+    return result
+
+
+def bench_writes(et, n):
+    values = {k: 0.5 for k in range(et.ao_n)}
+    bits = {k: bool(k & 1) for k in range(et.do_n)}
+    return {
+        'ao_write_channel': measure(lambda: et.ao_write_channel(0, 0.5), n),
+        'ao_write': measure(lambda: et.ao_write([0.5] * et.ao_n), n),
+        'ao_write_channels': measure(lambda: et.ao_write_channels(values), n),
+        'do_write_channel': measure(lambda: et.do_write_channel(0, True), n),
+        'do_write': measure(lambda: et.do_write([True] * et.do_n), n),
+        'do_write_channels': measure(lambda: et.do_write_channels(bits), n),
+    }
+
+
+def bench_conversion(n):
+    # codes to values for all ranges, vectorized table against per channel conversion
+    ranges = list(ET7000.ranges) * 8
+    table = ConversionTable(ranges)
+    codes = np.random.randint(0, 0x10000, size=len(table))
+    values = table.values(codes)
+    items = len(table)
+    result = {
+        'table_values': measure(lambda: table.values(codes), n),
+        'table_codes': measure(lambda: table.codes(values), n),
+        'per_channel_value': measure(lambda: [table.value(k, codes[k]) for k in range(items)], n),
+    }
+    for r in result.values():
+        r['items_per_s'] = r['ops_per_s'] * items
+    return result
+
+
+def bench_scaling(device_counts, n, workers=16):
+    # scans of N devices, each on its own stand-in server, sequential and on the scan scheduler pool
+    result = {}
+    scheduler = ScanScheduler(workers)
+    for count in device_counts:
+        servers = [ModbusStandIn().start() for i in range(count)]
+        devices = [ET7000('127.0.0.1', port=s.port) for s in servers]
+
+        def concurrent():
+            futures = [scheduler.submit(et.scan) for et in devices]
+            for f in futures:
+                f.result()
+
+        sequential = measure(lambda: [et.scan() for et in devices], n)
+        parallel = measure(concurrent, n)
+        for r in (sequential, parallel):
+            r['device_scans_per_s'] = r['ops_per_s'] * count
+        result[str(count)] = {'sequential': sequential, 'scheduler': parallel}
+        for et in devices:
+            et.__del__()
+        for s in servers:
+            s.stop()
+    scheduler.executor.shutdown()
+    return result
+
+
+def run(quick=False):
+    n = 200 if quick else 2000
+    results = {'time': time.time(),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'quick': quick}
+    fake = FakeET7000('fake', type='7026')
+    results['fake_reads'] = bench_reads(fake, n)
+    results['fake_writes'] = bench_writes(fake, n)
+    server = ModbusStandIn().start()
+    et = ET7000('127.0.0.1', port=server.port)
+    results['socket_reads'] = bench_reads(et, n // 4)
+    results['socket_writes'] = bench_writes(et, n // 4)
+    et.__del__()
+    server.stop()
+    results['conversion'] = bench_conversion(n)
+    results['scaling'] = bench_scaling((1, 4, 16) if quick else (1, 4, 16, 64), max(n // 40, 5))
+    return results
+
+
+def print_results(results, prefix=''):
+    for name, value in results.items():
+        if isinstance(value, dict) and 'us_per_op' in value:
+            print('%-50s %12.2f us %12.1f ops/s' % (prefix + name, value['us_per_op'], value['ops_per_s']))
+        elif isinstance(value, dict):
+            print_results(value, prefix + name + '.')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Offline benchmarks of ET7000 driver')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations')
+    parser.add_argument('--output', default='ET7000_benchmark.json', help='JSON results file')
+    args = parser.parse_args()
+
+    results = run(args.quick)
+    print_results(results)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results are written to %s' % args.output)
@@ -0,0 +1,225 @@
+import os
+import glob
+import json
+import queue
+import struct
+import time
+from threading import Thread
+
+import numpy as np
+
+from ET7000 import ConversionTable
+from log_exception import log_exception
+
+# Append-only recorder of scan snapshots to chunked preallocated binary files.
+# Chunk file: HEADER_SIZE bytes of header, then fixed size records.
+# Header: magic, number of written records (uint64 at offset 8), length of json layout (uint32 at 16), json layout.
+# Layout holds module type, channel counts and ranges to convert raw codes to values.
+# Record: time (epoch s), raw ai and ao codes, di and do bit masks and valid flags of banks.
+
+MAGIC = b'ET7REC01'
+HEADER_SIZE = 4096
+COUNT_OFFSET = 8
+CHUNK_SUFFIX = '.et7rec'
+# bits of record 'valid' field
+VALID_BITS = {'ai': 1, 'ao': 2, 'di': 4, 'do': 8}
+
+
+def record_dtype(ai_n: int, ao_n: int):
+    return np.dtype([('time', '<f8'),
+                     ('ai', '<u2', (ai_n,)),
+                     ('ao', '<u2', (ao_n,)),
+                     ('di', '<u8'),
+                     ('do', '<u8'),
+                     ('valid', 'u1')])
+
+
+def device_layout(et):
+    # what is needed to decode records of device et
+    return {'type': et.type,
+            'host': et.host,
+            'port': et.port,
+            'ai_n': et.ai_n,
+            'ai_ranges': [int(r) for r in et.ai_ranges],
+            'ai_masks': [bool(m) for m in et.ai_masks],
+            'ao_n': et.ao_n,
+            # ranges used by driver to convert ao codes
+            'ao_ranges': [int(r) for r in et.ao_table_ranges],
+            'di_n': et.di_n,
+            'do_n': et.do_n}
+
+
+# One stream of chunk files <path>_NNNNNN.et7rec, written by recorder thread only
+class ChunkWriter:
+    def __init__(self, path: str, chunk_records: int):
+        self.path = path
+        self.chunk_records = chunk_records
+        self.layout = None
+        self.records = None
+        self.count_view = None
+        self.count = 0
+        self.index = 0
+        for file_name in glob.glob(path + '_*' + CHUNK_SUFFIX):
+            try:
+                self.index = max(self.index, int(file_name[len(path) + 1:-len(CHUNK_SUFFIX)]))
+            except ValueError:
+                pass
+
+    def open(self, layout: dict):
+        self.close()
+        self.index += 1
+        self.layout = layout
+        dtype = record_dtype(layout['ai_n'], layout['ao_n'])
+        text = json.dumps(dict(layout, record_size=dtype.itemsize, capacity=self.chunk_records)).encode()
+        header_size = HEADER_SIZE * ((20 + len(text)) // HEADER_SIZE + 1)
+        file_name = '%s_%06d%s' % (self.path, self.index, CHUNK_SUFFIX)
+        with open(file_name, 'wb') as f:
+            f.write(MAGIC + struct.pack('<QI', 0, len(text)) + text)
+            # preallocate whole chunk
+            f.truncate(header_size + dtype.itemsize * self.chunk_records)
+        self.count_view = np.memmap(file_name, dtype='<u8', mode='r+', offset=COUNT_OFFSET, shape=(1,))
+        self.records = np.memmap(file_name, dtype=dtype, mode='r+', offset=header_size,
+                                 shape=(self.chunk_records,))
+        self.count = 0
+
+    def close(self):
+        if self.records is not None:
+            self.records.flush()
+            self.count_view.flush()
+        self.records = None
+        self.count_view = None
+
+    def write(self, layout: dict, t: float, snapshot: dict):
+        if self.records is None or self.count >= self.chunk_records or \
+                (layout is not self.layout and layout != self.layout):
+            self.open(layout)
+        record = self.records[self.count]
+        record['time'] = t
+        valid = 0
+        for bank, bit in VALID_BITS.items():
+            data = snapshot.get(bank)
+            if data is not None and layout[bank + '_n'] > 0:
+                record[bank] = data
+                valid |= bit
+        record['valid'] = valid
+        self.count += 1
+        # count is updated after record, readers never see partial record
+        self.count_view[0] = self.count
+
+
+# Records snapshots of many devices, record() only puts references to immutable snapshot data
+# into queue, files are written by recorder thread. If queue is full record is dropped.
+class ET7000Recorder:
+    def __init__(self, directory: str, chunk_records=65536, queue_size=10000, logger=None):
+        self.directory = directory
+        self.chunk_records = chunk_records
+        self.logger = logger
+        self.queue = queue.Queue(queue_size)
+        self.writers = {}
+        # per device: (conversion tables the layout was made for, layout)
+        self.layouts = {}
+        self.recorded = 0
+        self.dropped = 0
+        self.errors = 0
+        self.thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = Thread(target=self._run, name='ET7000Recorder', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def record(self, name: str, et, t=None):
+        # non-blocking, returns False if record was dropped
+        key = (et.ai_table, et.ao_table, et.di_n, et.do_n)
+        cached = self.layouts.get(name)
+        if cached is None or cached[0] != key:
+            cached = (key, device_layout(et))
+            self.layouts[name] = cached
+        try:
+            self.queue.put_nowait((name, cached[1], time.time() if t is None else t, dict(et.snapshot)))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            name, layout, t, snapshot = item
+            try:
+                writer = self.writers.get(name)
+                if writer is None:
+                    file_name = name.replace('/', '_').replace(':', '_')
+                    writer = ChunkWriter(os.path.join(self.directory, file_name), self.chunk_records)
+                    self.writers[name] = writer
+                writer.write(layout, t, snapshot)
+                self.recorded += 1
+            except KeyboardInterrupt:
+                raise
+            except:
+                self.errors += 1
+                log_exception(self.logger, 'Recorder write error for %s' % name)
+        for writer in self.writers.values():
+            writer.close()
+
+    def report(self):
+        return {'recorded': self.recorded, 'dropped': self.dropped, 'errors': self.errors,
+                'queue': self.queue.qsize()}
+
+
+# ******** reading recorded files ***********
+def read_chunk(file_name: str):
+    # (layout, records) of chunk file, records is read only numpy view of written records in mapped file
+    with open(file_name, 'rb') as f:
+        header = f.read(20)
+        if header[:8] != MAGIC:
+            raise ValueError('%s is not ET7000 record file' % file_name)
+        count, length = struct.unpack('<QI', header[8:20])
+        layout = json.loads(f.read(length).decode())
+    header_size = HEADER_SIZE * ((20 + length) // HEADER_SIZE + 1)
+    dtype = record_dtype(layout['ai_n'], layout['ao_n'])
+    if count <= 0:
+        return layout, np.zeros(0, dtype=dtype)
+    records = np.memmap(file_name, dtype=dtype, mode='r', offset=header_size, shape=(count,))
+    return layout, records
+
+
+def chunk_files(path: str):
+    # chunk files of stream path in order of writing
+    return sorted(glob.glob(path + '_*' + CHUNK_SUFFIX))
+
+
+def read_records(path: str):
+    # list of (layout, records) for all chunks of stream
+    return [read_chunk(f) for f in chunk_files(path)]
+
+
+def record_values(layout: dict, records):
+    # converted ai and ao values and unpacked di, do bits of records, NaN for invalid banks
+    ai = ConversionTable(layout['ai_ranges'], layout['ai_masks']).values(records['ai'])
+    ao = ConversionTable(layout['ao_ranges']).values(records['ao'])
+    ai[(records['valid'] & VALID_BITS['ai']) == 0] = np.nan
+    ao[(records['valid'] & VALID_BITS['ao']) == 0] = np.nan
+    result = {'time': np.asarray(records['time']), 'ai': ai, 'ao': ao}
+    for bank in ('di', 'do'):
+        n = layout[bank + '_n']
+        result[bank] = ((records[bank][:, None] >> np.arange(n, dtype=np.uint64)) & np.uint64(1)).astype(bool)
+    return result
+
+
+if __name__ == "__main__":
+    # print summary of recorded stream: python ET7000_Recorder.py records/test_nodb_dev
+    import sys
+    for layout, records in read_records(sys.argv[1]):
+        print(hex(layout['type']), layout['host'], len(records), 'records',
+              records['time'][0] if len(records) else '', records['time'][-1] if len(records) else '')
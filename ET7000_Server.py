@@ -6,25 +6,57 @@ ICP DAS ET7000 tango device server"""
 import os, sys
 if os.path.realpath('../TangoUtils') not in sys.path: sys.path.append(os.path.realpath('../TangoUtils'))
 
+import json
+import random
 import time
 import math
 from threading import Lock, RLock
 
+import numpy as np
 import tango
 from tango import AttrQuality, AttrWriteType, DispLevel, DevState, DebugIt, AttributeInfoEx, Attr
 from tango.server import Device, attribute, command
 from ET7000 import FakeET7000
-from ET7000 import ET7000
+from ET7000 import ET7000, DriverRegistry
+from ET7000_Recorder import ET7000Recorder
+from ModbusTransport import TransportStats, PRIORITY_NAMES, PRIORITY_SCAN, PRIORITY_DIAGNOSTICS, request_priority
+from RingBuffer import RingBuffer, decimate
+from ScanScheduler import AdaptiveScan, ScanScheduler
 from TangoServerPrototype import TangoServerPrototype
 from log_exception import log_exception
 
 DEFAULT_IP = '192.168.1.122'
+DEFAULT_PORT = 502
 DEFAULT_RECONNECT_TIMEOUT = 5.0
+DEFAULT_RECONNECT_MIN_DELAY = 0.5
+DEFAULT_RECONNECT_MAX_DELAY = 60.0
+DEFAULT_MAX_AGE = 0.2
+DEFAULT_SCAN_PERIOD = 1.0
+DEFAULT_SCAN_WORKERS = 16
+DEFAULT_RECONNECT_WORKERS = 4
+DEFAULT_SCAN_BUDGET = 0.0
+DEFAULT_METADATA_CACHE = 'ET7000_metadata.json'
+DEFAULT_METADATA_MAX_AGE = 86400.0
+DEFAULT_EVENT_DEADBAND = 0.001
+DEFAULT_WRITE_COALESCE_WINDOW = 0.0
+DEFAULT_OUTPUT_READBACK = 5.0
+DEFAULT_ACQUISITION_CAPACITY = 0
+DEFAULT_ACQUISITION_WINDOW = 1000
+DEFAULT_HISTORY_CAPACITY = 3600
+DEFAULT_RECORDER_CHUNK = 65536
+DEFAULT_READ_GAP = 8
 LOOP_TIMEOUT = 10.0
+STATE_DISCONNECTED = 0
+STATE_CONNECTING = 1
+STATE_CONNECTED = 2
 
 
 class ET7000_Server(TangoServerPrototype):
     init_da = True
+    scheduler = None
+    # guards swap and release of drivers by connection threads and delete_device
+    drivers_lock = Lock()
+    recorder = None
     server_version_value = '7.0'
     server_name_value = 'Tango Server for ICP DAS ET-7000 Series Devices'
 
@@ -40,6 +72,58 @@ class ET7000_Server(TangoServerPrototype):
                    unit="", format="%s",
                    doc="ET7000 device IP address")
 
+    scan_rate = attribute(label="scan_rate", dtype=float,
+                          display_level=DispLevel.EXPERT,
+                          access=AttrWriteType.READ,
+                          unit="Hz", format="%6.2f",
+                          doc="Achieved rate of background scans")
+
+    scan_rate_requested = attribute(label="scan_rate_requested", dtype=float,
+                                    display_level=DispLevel.EXPERT,
+                                    access=AttrWriteType.READ,
+                                    unit="Hz", format="%6.2f",
+                                    doc="Requested rate of background scans, 0 - scans disabled")
+
+    latency_p50 = attribute(label="latency_p50", dtype=float,
+                            display_level=DispLevel.EXPERT,
+                            access=AttrWriteType.READ,
+                            unit="ms", format="%8.3f",
+                            doc="Median latency of modbus transactions since last stats reset")
+
+    latency_p99 = attribute(label="latency_p99", dtype=float,
+                            display_level=DispLevel.EXPERT,
+                            access=AttrWriteType.READ,
+                            unit="ms", format="%8.3f",
+                            doc="99th percentile of modbus transaction latency since last stats reset")
+
+    latency_max = attribute(label="latency_max", dtype=float,
+                            display_level=DispLevel.EXPERT,
+                            access=AttrWriteType.READ,
+                            unit="ms", format="%8.3f",
+                            doc="Maximal modbus transaction latency since last stats reset")
+
+    error_rate = attribute(label="error_rate", dtype=float,
+                           display_level=DispLevel.EXPERT,
+                           access=AttrWriteType.READ,
+                           unit="", format="%6.4f",
+                           doc="Fraction of failed modbus transactions since last stats reset")
+
+    queue_depth = attribute(label="queue_depth", dtype=int,
+                            dformat=tango.AttrDataFormat.SPECTRUM,
+                            max_dim_x=len(PRIORITY_NAMES),
+                            display_level=DispLevel.EXPERT,
+                            access=AttrWriteType.READ,
+                            doc="Waiting modbus requests by priority: %s" % ', '.join(PRIORITY_NAMES))
+
+    queue_wait = attribute(label="queue_wait", dtype=float,
+                           dformat=tango.AttrDataFormat.SPECTRUM,
+                           max_dim_x=len(PRIORITY_NAMES),
+                           display_level=DispLevel.EXPERT,
+                           access=AttrWriteType.READ,
+                           unit="ms", format="%8.3f",
+                           doc="99th percentile of queue wait since last stats reset by priority: %s"
+                               % ', '.join(PRIORITY_NAMES))
+
     # ******** init_device ***********
     def init_device(self):
         # ET7000_Server.devices.pop(self.get_name(), None)
@@ -61,78 +145,238 @@ class ET7000_Server(TangoServerPrototype):
         self.error_time = 0.0
         # parameters from config
         self.emulate = self.config.get('emulate', False)
+        # type of emulated module, additional types are loaded from emulate_profiles json file
+        self.emulate_type = self.config.get('emulate_type', '7026')
+        emulate_profiles = self.config.get('emulate_profiles', '')
+        if self.emulate and emulate_profiles:
+            try:
+                FakeET7000.load_profiles(emulate_profiles)
+            except KeyboardInterrupt:
+                raise
+            except:
+                self.log_exception('Emulated module profiles loading error')
         self.reconnect_timeout = self.config.get('reconnect_timeout', DEFAULT_RECONNECT_TIMEOUT)
-        self.reconnect_time = time.time() + self.reconnect_timeout
+        self.reconnect_min_delay = self.config.get('reconnect_min_delay', DEFAULT_RECONNECT_MIN_DELAY)
+        self.reconnect_max_delay = self.config.get('reconnect_max_delay', DEFAULT_RECONNECT_MAX_DELAY)
+        self.reconnect_delay = self.reconnect_min_delay
+        self.reconnect_time = 0.0
+        self.connection_state = STATE_DISCONNECTED
         self.show_disabled_channels = self.config.get('show_disabled_channels', False)
+        # change and archive events pushed by background scans
+        self.push_events = self.config.get('push_events', True)
+        # default deadband relative to channel range and per channel deadbands:
+        # number - absolute, string with '%' - percent of channel range
+        self.event_deadband = self.config.get('event_deadband', DEFAULT_EVENT_DEADBAND)
+        self.deadbands = {}
+        deadbands = self.config.get('deadbands', {})
+        if not isinstance(deadbands, dict):
+            self.log_warning('deadbands should be dict {attribute name: deadband}, ignored')
+            deadbands = {}
+        for attr_name, db in deadbands.items():
+            try:
+                if isinstance(db, str) and db.strip().endswith('%'):
+                    float(db.strip()[:-1])
+                else:
+                    db = float(db)
+                self.deadbands[attr_name] = db
+            except (TypeError, ValueError):
+                self.log_warning('Wrong deadband %s for %s ignored' % (db, attr_name))
+        self.event_values = {}
+        # ao and do attribute writes within window are merged to one transaction, 0.0 - no merging.
+        # Coalescers belong to the shared driver, so concurrent writes to devices pointing to one module
+        # are merged. Tango serializes requests to one device (serialization model BY_DEVICE),
+        # writes to channels of a single device are merged only with serialization model NO_SYNC
+        self.write_coalesce_window = self.config.get('write_coalesce_window', DEFAULT_WRITE_COALESCE_WINDOW)
+        self.ao_writer = None
+        self.do_writer = None
+        # directory for binary records of every scan, '' - no recording
+        self.recorder_dir = self.config.get('recorder_dir', '')
+        # modbus latency and error statistics, kept over reconnections
+        self.transport_stats = TransportStats()
+        # di edges between scans, bit k is channel k
+        self.edges_lock = Lock()
+        self.di_last = None
+        self.di_rising_edges = 0
+        self.di_falling_edges = 0
+        self.scan_period = self.config.get('scan_period', DEFAULT_SCAN_PERIOD)
+        # ai values of background scans, history_capacity scans are kept, 0 - no history.
+        # Memory is history_capacity rows of ai_n doubles per device whatever scan_period is,
+        # time span of history is history_capacity * scan_period
+        self.history_capacity = self.config.get('history_capacity', DEFAULT_HISTORY_CAPACITY)
+        self.history = None
+        # adaptive scan: every bank is read with its own period between scan_period and scan_max_period
+        # chosen by rate of change of its channels, total reads per second of the device
+        # are kept under scan_budget, 0.0 - no limit
+        self.adaptive_scan = self.config.get('adaptive_scan', False) and self.scan_period > 0.0
+        self.scan_max_period = max(self.config.get('scan_max_period', 10.0 * self.scan_period), self.scan_period)
+        self.scan_budget = self.config.get('scan_budget', DEFAULT_SCAN_BUDGET)
+        # change of channel between reads targeted by adaptive scan, relative to channel range
+        self.adaptive_resolution = self.config.get('adaptive_resolution', self.event_deadband)
+        self.adaptive = None
+        # channel reads are served from background scans if it is enabled
+        if self.adaptive_scan:
+            self.max_age = self.config.get('max_age', 2.0 * self.scan_max_period)
+        elif self.scan_period > 0.0:
+            self.max_age = self.config.get('max_age', 2.0 * self.scan_period)
+        else:
+            self.max_age = self.config.get('max_age', DEFAULT_MAX_AGE)
+        # ao and do reads are served from written values, device is read back with this period
+        self.output_readback = self.config.get('output_readback', DEFAULT_OUTPUT_READBACK)
+        # continuous ai acquisition ring buffer size in samples, 0 - no acquisition,
+        # and number of the latest samples in ai_window attribute
+        self.acquisition_capacity = self.config.get('acquisition_capacity', DEFAULT_ACQUISITION_CAPACITY)
+        self.acquisition_window = min(self.config.get('acquisition_window', DEFAULT_ACQUISITION_WINDOW),
+                                      max(self.acquisition_capacity, 1))
+        # device configuration cache file, relative to server directory, '' - always read configuration from device
+        self.metadata_cache = self.config.get('metadata_cache', DEFAULT_METADATA_CACHE)
+        # cached configuration older than metadata_max_age seconds is read from device again,
+        # Init and reconnect command always read configuration from device
+        self.metadata_max_age = self.config.get('metadata_max_age', DEFAULT_METADATA_MAX_AGE)
+        self.rediscover = True
+        # unused addresses between requested ones merged into one request by read_modbus_multi
+        self.read_gap = self.config.get('read_gap', DEFAULT_READ_GAP)
         self.ip = self.config.get('ip', None)
         if self.ip is None:
             self.ip = self.config.get('IP', DEFAULT_IP)
-        # check if ip is in use
-        # for d in ET7000_Server.devices:
-        #     v = ET7000_Server.devices[d]
-        #     if not v.emulate and v.ip == ip:
-        #         msg = '%s IP address %s is in use' % (self.get_name(), ip)
-        #         self.logger.error(msg)
-        #         self.set_state(DevState.FAULT)
-        #         return
-        # self.ip = ip
+        # modbus tcp port, non default for simulated modules
+        self.port = self.config.get('port', DEFAULT_PORT)
+        # devices with the same ip and port are allowed, they share one driver from DriverRegistry
         self.pre = f'{self.get_name()} ET7XXX at {self.ip}'
+        # add device to list
+        ET7000_Server.devices[self.get_name()] = self
+        # all connection attempts are done in background, attributes are created by looping()
+        self.deleted = False
+        self.connection_state = STATE_DISCONNECTED
+        self.reconnect_delay = self.reconnect_min_delay
+        self.reconnect_time = 0.0
+        self.schedule_reconnect()
+        # add device to background scans
+        if self.scan_period > 0.0:
+            self.get_scheduler().add(self.get_name(), self.scan, self.scan_period)
+
+    def connect(self):
+        # discovery requests must not delay operator requests to modules sharing the connection
+        with request_priority(PRIORITY_DIAGNOSTICS):
+            return self._connect()
+
+    def _connect(self):
+        # create ICP DAS device and read its configuration, returns True on success.
+        # New driver is built aside and swapped in at the end, requests which passed is_connected()
+        # before still find a driver in self.et, it is released after the swap
+        self.connection_state = STATE_CONNECTING
+        t_start = time.time()
+        et = None
+        swapped = False
         try:
-            # create ICP DAS device
             if self.emulate:
-                self.et = FakeET7000(self.ip, logger=self.logger)
+                et = FakeET7000(self.ip, logger=self.logger, max_age=self.max_age,
+                                output_readback=self.output_readback, read_gap=self.read_gap,
+                                type=self.emulate_type)
             else:
-                self.et = ET7000(self.ip, logger=self.logger)
-            self.et.client.auto_close = False
+                # devices pointing to the same module share one driver
+                et = DriverRegistry.acquire(self.ip, self.port, logger=self.logger, max_age=self.max_age,
+                                            output_readback=self.output_readback, read_gap=self.read_gap,
+                                            metadata_cache=self.metadata_cache or None,
+                                            metadata_max_age=self.metadata_max_age)
+            et.client.auto_close = False
+            if hasattr(et.client, 'stats'):
+                if self.emulate or DriverRegistry.users(et) <= 1:
+                    et.client.stats = self.transport_stats
+                else:
+                    self.transport_stats = et.client.stats
             # wait for device initiate after possible reboot
             t0 = time.time()
-            while self.et.read_module_type() == 0:
-                self.error_time = time.time()
-                if time.time() - t0 > 5.0:
-                    msg = 'Device is not ready'
-                    self.log_error(msg)
-                    self.set_state(DevState.FAULT, msg)
-                    return
+            while et.read_module_type() == 0:
+                is_open = getattr(et.client, 'is_open', True)
+                if callable(is_open):
+                    is_open = is_open()
+                if not et.is_open or not is_open:
+                    self.release_driver(et)
+                    return self.set_disconnected('Device is offline')
+                if time.time() - t0 > self.reconnect_timeout:
+                    self.release_driver(et)
+                    return self.set_disconnected('Device is not ready')
+                time.sleep(min(0.2, self.reconnect_timeout))
+            if et.type == 0:
+                # unknown device
+                self.release_driver(et)
+                return self.set_disconnected('PET creation error')
+            # configuration may be changed on module by other tools, cached or shared driver reads it again
+            if self.rediscover and et.discovery_time < t_start:
+                et.discover()
+            self.rediscover = False
+            with ET7000_Server.drivers_lock:
+                if self.deleted or self.ip is None:
+                    # device was deleted during connection
+                    self.release_driver(et)
+                    return False
+                old, self.et = self.et, et
+                swapped = True
+                if old is not None:
+                    self.release_driver(old)
+            if self.write_coalesce_window > 0.0:
+                self.ao_writer = DriverRegistry.writer(et, 'ao', self.write_coalesce_window, logger=self.logger)
+                self.do_writer = DriverRegistry.writer(et, 'do', self.write_coalesce_window, logger=self.logger)
             self.pre = f'{self.get_name()} ET{self.et.type_str}'
             if not self.emulate:
                 self.pre = f'{self.pre} at {self.ip}'
-            # add device to list
-            ET7000_Server.devices[self.get_name()] = self
-            # check if device type is recognized
-            if self.et and self.et.type != 0:
-                # device is recognized
-                msg = 'has been created'
-                self.set_state(DevState.RUNNING, msg)
-                self.log_info(msg)
-                # if it is not first time init
-                if hasattr(self, 'deleted') and self.deleted:
-                    self.initialize_dynamic_attributes()
-                    self.restore_polling()
-                    self.deleted = False
-                self.set_state(DevState.RUNNING, 'Initialization finished')
-                self.error_time = 0.0
-            else:
-                # unknown device
-                msg = 'PET creation error'
-                self.set_state(DevState.FAULT, msg)
-                self.log_error(msg)
-                self.error_time = time.time()
+            # device is recognized
+            self.connection_state = STATE_CONNECTED
+            self.reconnect_delay = self.reconnect_min_delay
+            # channel counts may differ after reconnection
+            self.adaptive = None
+            self.error_time = 0.0
+            if self.acquisition_capacity > 0 and self.et.ai_n > 0 and not self.et.acquiring:
+                self.et.start_acquisition(self.acquisition_capacity)
+            self.log_info('has been created')
+            self.set_state(DevState.RUNNING, 'Initialization finished')
+            return True
         except KeyboardInterrupt:
             raise
         except:
-            self.et = None
-            self.ip = None
-            self.error_time = time.time()
             msg = 'init_device exception'
             self.log_exception(msg)
-            self.set_state(DevState.FAULT, msg)
+            if et is not None and not swapped:
+                self.release_driver(et)
+            return self.set_disconnected(msg)
+
+    def release_driver(self, et):
+        if self.emulate:
+            et.__del__()
+        else:
+            DriverRegistry.release(et)
+
+    def set_disconnected(self, msg='Device is offline'):
+        # schedule next reconnection with exponential backoff and jitter
+        self.connection_state = STATE_DISCONNECTED
+        self.error_time = time.time()
+        self.reconnect_time = time.time() + self.reconnect_delay * random.uniform(0.8, 1.2)
+        self.reconnect_delay = min(2.0 * self.reconnect_delay, self.reconnect_max_delay)
+        self.log_error(msg)
+        self.set_state(DevState.FAULT, msg)
+        return False
+
+    def schedule_reconnect(self):
+        # start background reconnection if it is due, never blocks
+        if self.connection_state != STATE_DISCONNECTED or time.time() < self.reconnect_time:
+            return
+        if self.ip is None:
+            # device was deleted
+            return
+        self.connection_state = STATE_CONNECTING
+        # connection may block for reconnect_timeout, it must not take workers of scans
+        self.get_scheduler().submit_background(self.connect)
 
     def delete_device(self):
+        if ET7000_Server.scheduler is not None:
+            ET7000_Server.scheduler.remove(self.get_name())
         super().delete_device()
-        self.et.__del__()
-        self.et = None
-        self.ip = None
-        self.deleted = True
+        with ET7000_Server.drivers_lock:
+            if self.et is not None:
+                self.release_driver(self.et)
+            self.et = None
+            self.ip = None
+            self.deleted = True
         msg = 'Device has been deleted'
         self.log_info(msg)
         self.set_state(DevState.DISABLE, msg)
@@ -148,8 +392,38 @@ class ET7000_Server(TangoServerPrototype):
     def read_IP(self):
         return str(self.ip)
 
+    def read_scan_rate(self):
+        if ET7000_Server.scheduler is None:
+            return 0.0
+        return ET7000_Server.scheduler.report(self.get_name()).get('achieved_rate', 0.0)
+
+    def read_scan_rate_requested(self):
+        if ET7000_Server.scheduler is None:
+            return 0.0
+        return ET7000_Server.scheduler.report(self.get_name()).get('requested_rate', 0.0)
+
+    def read_latency_p50(self):
+        return self.transport_stats.histogram().percentile(50.0) * 1000.0
+
+    def read_latency_p99(self):
+        return self.transport_stats.histogram().percentile(99.0) * 1000.0
+
+    def read_latency_max(self):
+        return self.transport_stats.histogram().max * 1000.0
+
+    def read_error_rate(self):
+        return self.transport_stats.error_rate()
+
+    def read_queue_depth(self):
+        if self.et is None or not hasattr(self.et.client, 'queue_depths'):
+            return [0] * len(PRIORITY_NAMES)
+        return self.et.client.queue_depths()
+
+    def read_queue_wait(self):
+        return [self.transport_stats.wait_histogram(level).percentile(99.0) * 1000.0
+                for level in range(len(PRIORITY_NAMES))]
+
     def read_all(self, attr: tango.Attribute):
-        # with self.lock:
         attr_name = attr.get_name()
         if not self.is_connected():
             self.log_debug('Waiting for reconnect')
@@ -167,15 +441,103 @@ class ET7000_Server(TangoServerPrototype):
             msg = "Read for unknown attribute %s" % attr_name
             self.log_error(msg)
             return self.set_error_attribute_value(attr)
-        if val is not None:
+        if val is not None and None not in val:
             attr.set_value(val)
             attr.set_quality(tango.AttrQuality.ATTR_VALID)
             return val
         else:
             return self.set_error_attribute_value(attr)
 
+    def read_mask(self, attr: tango.Attribute):
+        if not self.is_connected():
+            return self.set_error_attribute_value(attr)
+        if attr.get_name().startswith('di'):
+            val = self.et.di_read_mask()
+        else:
+            val = self.et.do_read_mask()
+        if val is None:
+            return self.set_error_attribute_value(attr)
+        attr.set_value(val)
+        attr.set_quality(tango.AttrQuality.ATTR_VALID)
+        return val
+
+    def write_mask(self, attr: tango.WAttribute):
+        if not self.is_connected() or not self.et.do_write_mask(int(attr.get_write_value())):
+            self.log_error('Error writing %s', attr.get_name())
+            self.set_error_attribute_value(attr)
+            return
+        attr.set_quality(tango.AttrQuality.ATTR_VALID)
+
+    def read_acquisition(self, attr: tango.Attribute):
+        if not self.is_connected():
+            return self.set_error_attribute_value(attr)
+        attr_name = attr.get_name()
+        if attr_name == 'sample_rate':
+            val = self.et.acquisition_rate()
+            attr.set_value(val)
+            return val
+        times, values = self.et.acquisition_values(self.acquisition_window)
+        if len(times) <= 0:
+            return self.set_error_attribute_value(attr)
+        if attr_name == 'ai_window':
+            val = values
+        else:
+            # monotonic sample times to epoch seconds
+            val = times + (time.time() - time.monotonic())
+        attr.set_value(val)
+        # samples are read back-to-back, no new sample within a few timeouts means failing reads
+        if not self.et.acquiring or time.monotonic() - times[-1] > max(2.0 * self.et.timeout, 1.0):
+            attr.set_quality(tango.AttrQuality.ATTR_INVALID)
+        return val
+
+    def read_edges(self, attr: tango.Attribute):
+        # edges detected by scans are latched until read
+        with self.edges_lock:
+            if attr.get_name() == 'di_rising':
+                val = self.di_rising_edges
+                self.di_rising_edges = 0
+            else:
+                val = self.di_falling_edges
+                self.di_falling_edges = 0
+        attr.set_value(val)
+        if self.scan_period <= 0.0:
+            attr.set_quality(tango.AttrQuality.ATTR_INVALID)
+        return val
+
+    def update_edges(self):
+        di = self.et.snapshot['di']
+        if di is None:
+            return
+        with self.edges_lock:
+            if self.di_last is not None:
+                changed = di ^ self.di_last
+                self.di_rising_edges |= changed & di
+                self.di_falling_edges |= changed & self.di_last
+            self.di_last = di
+
+    def write_all(self, attr: tango.WAttribute):
+        attr_name = attr.get_name()
+        if not self.is_connected():
+            self.log_debug('%s Waiting for reconnect', attr_name)
+            self.set_error_attribute_value(attr)
+            return
+        value = attr.get_write_value()
+        ad = attr_name[-2:]
+        if ad == 'ao':
+            result = self.et.ao_write([float(v) for v in value])
+        elif ad == 'do':
+            result = self.et.do_write([bool(v) for v in value])
+        else:
+            self.log_error('Write to unknown attribute %s', attr_name)
+            self.set_error_attribute_value(attr)
+            return
+        if result:
+            attr.set_quality(tango.AttrQuality.ATTR_VALID)
+        else:
+            self.log_error('Error writing %s', attr_name)
+            self.set_error_attribute_value(attr)
+
     def read_general(self, attr: tango.Attribute):
-        # with self.lock:
         attr_name = attr.get_name()
         # self.LOGGER.debug('entry %s %s', self.get_name(), attr_name)
         if self.is_connected():
@@ -187,7 +549,6 @@ class ET7000_Server(TangoServerPrototype):
         return self.set_attribute_value(attr, val)
 
     def write_general(self, attr: tango.WAttribute):
-        # with self.lock:
         attr_name = attr.get_name()
         # self.logger.debug('entry %s %s', self.get_name(), attr_name)
         if not self.is_connected():
@@ -202,10 +563,16 @@ class ET7000_Server(TangoServerPrototype):
         ad = attr_name[:2]
         mask = True
         if ad == 'ao':
-            result = self.et.ao_write_channel(chan, value)
+            if self.write_coalesce_window > 0.0:
+                result = self.ao_writer.write(chan, value)
+            else:
+                result = self.et.ao_write_channel(chan, value)
             mask = self.et.ao_masks[chan]
         elif ad == 'do':
-            result = self.et.do_write_channel(chan, value)
+            if self.write_coalesce_window > 0.0:
+                result = self.do_writer.write(chan, value)
+            else:
+                result = self.et.do_write_channel(chan, value)
         else:
             msg = "%s Write to unknown attribute %s" % (self.get_name(), attr_name)
             self.logger.error(msg)
@@ -267,6 +634,20 @@ class ET7000_Server(TangoServerPrototype):
             self.log_exception('read_modbus exception')
             return [float('nan')] * n
 
+    @command(dtype_in=(float,), dtype_out=(float,))
+    def read_modbus_multi(self, data):
+        # data: addresses in 0/10000/30000/40000 notation, returns values in the same order,
+        # NaN for addresses which could not be read
+        addresses = [int(a) for a in data]
+        try:
+            result = self.et.read_modbus_multi(addresses)
+            return [float('nan') if result[a] is None else float(result[a]) for a in addresses]
+        except KeyboardInterrupt:
+            raise
+        except:
+            self.log_exception('read_modbus_multi exception')
+            return [float('nan')] * len(addresses)
+
     @command(dtype_in=[float], dtype_out=bool)
     def write_modbus(self, data):
         self.logger.debug('%s', data)
@@ -287,23 +668,207 @@ class ET7000_Server(TangoServerPrototype):
             self.log_exception('write_modbus exception')
             return False
 
+    @command(dtype_in=(float,), dtype_out=(float,))
+    def read_history(self, args):
+        # args: [channel, start, stop, points], start and stop are epoch seconds,
+        # values <= 0 are relative to now, e.g. [0, -3600, 0, 500] - last hour of ai00 in 500 points.
+        # Returns [times..., min..., max..., mean...], four blocks of equal length up to points
+        if self.history is None or len(args) < 4:
+            return []
+        channel = int(args[0])
+        if channel < 0 or channel >= self.history.width:
+            return []
+        now = time.time()
+        start = args[1] if args[1] > 0.0 else now + args[1]
+        stop = args[2] if args[2] > 0.0 else now + args[2]
+        times, values = self.history.between(start, stop, channel)
+        return np.concatenate(decimate(times, values, int(args[3]), start, stop))
+
+    @command(dtype_out=str)
+    def recorder_report(self):
+        # recorded and dropped scans of all devices in the server
+        if ET7000_Server.recorder is None:
+            return '{}'
+        return json.dumps(ET7000_Server.recorder.report())
+
+    @command(dtype_out=str)
+    def scan_report(self):
+        # requested and achieved scan rates of all devices in the server
+        if ET7000_Server.scheduler is None:
+            return '{}'
+        return json.dumps(ET7000_Server.scheduler.report())
+
+    @command(dtype_out=str)
+    def adaptive_report(self):
+        # current period, rate and activity (range fraction per second) of every bank in adaptive scan
+        if self.adaptive is None:
+            return '{}'
+        return json.dumps(self.adaptive.report())
+
+    @command(dtype_out=str)
+    def transport_report(self):
+        # modbus request counters and per function code latency percentiles in seconds
+        return json.dumps(self.transport_stats.report())
+
+    @command
+    def reset_stats(self):
+        self.transport_stats.reset()
+
     @command
     def reconnect(self):
-        if time.time() < self.reconnect_time:
-            self.logger.debug('Reconnection timeout')
+        # immediate reconnection in background
+        if self.connection_state == STATE_CONNECTING:
+            self.logger.debug('Reconnection is in progress')
             return
-        # self.delete_device()
-        # self.logger.debug('mark')
-        self.init_device()
-        self.initialize_dynamic_attributes()
-        self.restore_polling()
-        msg = '%s Reconnected' % self.name
-        self.logger.info(msg)
-        self.reconnection_time = time.time() + self.reconnect_timeout
+        self.connection_state = STATE_DISCONNECTED
+        self.reconnect_delay = self.reconnect_min_delay
+        self.reconnect_time = 0.0
+        self.rediscover = True
+        self.schedule_reconnect()
 
     # ******** additional helper functions ***********
+    def get_scheduler(self):
+        # one scheduler for all devices in the server
+        if ET7000_Server.scheduler is None:
+            workers = self.config.get('scan_workers', DEFAULT_SCAN_WORKERS)
+            reconnect_workers = self.config.get('reconnect_workers', DEFAULT_RECONNECT_WORKERS)
+            ET7000_Server.scheduler = ScanScheduler(workers, logger=self.logger, background_workers=reconnect_workers)
+            ET7000_Server.scheduler.start()
+        return ET7000_Server.scheduler
+
+    def get_recorder(self):
+        # one recorder thread for all devices in the server, directory is taken from the first device
+        if ET7000_Server.recorder is None:
+            chunk = self.config.get('recorder_chunk', DEFAULT_RECORDER_CHUNK)
+            ET7000_Server.recorder = ET7000Recorder(self.recorder_dir, chunk, logger=self.logger)
+            ET7000_Server.recorder.start()
+        return ET7000_Server.recorder
+
+    def scan(self):
+        # called by scheduler: refresh snapshot of all banks of the device
+        if not self.is_connected():
+            return
+        banks = None
+        if self.adaptive_scan:
+            banks = self.due_banks()
+            if not banks:
+                return
+        # banks refreshed by other devices sharing the driver within half period are not read again
+        with request_priority(PRIORITY_SCAN):
+            self.et.scan(0.5 * self.scan_period, banks)
+        if banks:
+            self.update_adaptive(banks)
+        if self.et.snapshot['ai'] is None and self.et.ai_n > 0:
+            self.error_time = time.time()
+        self.update_edges()
+        self.update_history()
+        if self.recorder_dir:
+            self.get_recorder().record(self.get_name(), self.et)
+        if self.push_events:
+            self.push_channel_events()
+
+    def due_banks(self):
+        # banks of adaptive scan which periods have elapsed
+        if self.adaptive is None:
+            banks = [b for b in ('ai', 'ao', 'di', 'do') if getattr(self.et, b + '_n') > 0]
+            self.adaptive = AdaptiveScan(banks, self.scan_period, self.scan_max_period,
+                                         self.scan_budget, self.adaptive_resolution)
+        return self.adaptive.due(time.time())
+
+    def update_adaptive(self, banks):
+        t = time.time()
+        for bank in banks:
+            spans = None
+            if bank in ('ai', 'ao'):
+                spans = [abs(v1 - v0) for v0, v1 in zip(getattr(self.et, bank + '_min'),
+                                                        getattr(self.et, bank + '_max'))]
+            self.adaptive.update(bank, self.et.snapshot_values(bank), t, spans)
+
+    def update_history(self):
+        if self.history_capacity <= 0 or self.et.ai_n <= 0:
+            return
+        values = self.et.snapshot_values('ai')
+        if values is None:
+            return
+        if self.history is None or self.history.width != self.et.ai_n:
+            self.history = RingBuffer(self.history_capacity, self.et.ai_n)
+        self.history.append(values, time.time())
+
+    def enable_events(self, attr_name):
+        # events for channel attributes are pushed by server
+        if self.push_events and self.scan_period > 0.0:
+            self.set_change_event(attr_name, True, False)
+            self.set_archive_event(attr_name, True, False)
+
+    def get_deadband(self, attr_name):
+        ad = attr_name[:2]
+        k = int(attr_name[-2:])
+        if ad not in ('ai', 'ao'):
+            return 0.0
+        span = abs(getattr(self.et, ad + '_max')[k] - getattr(self.et, ad + '_min')[k])
+        db = self.deadbands.get(attr_name, None)
+        if db is None:
+            return self.event_deadband * span
+        if isinstance(db, str) and db.strip().endswith('%'):
+            return float(db.strip()[:-1]) * 0.01 * span
+        return float(db)
+
+    def push_channel_events(self):
+        # push events for channels changed more than deadband since last pushed value
+        for ad in ('ai', 'ao', 'di', 'do'):
+            values = self.et.snapshot_values(ad)
+            for k in range(getattr(self.et, ad + '_n')):
+                attr_name = '%s%02d' % (ad, k)
+                if attr_name not in self.dynamic_attributes:
+                    continue
+                v = None if values is None else values[k]
+                if v is not None and isinstance(v, float) and math.isnan(v):
+                    v = None
+                if attr_name in self.event_values:
+                    last = self.event_values[attr_name]
+                    if v is None or last is None:
+                        if v is last:
+                            continue
+                    elif ad in ('ai', 'ao'):
+                        if abs(v - last) <= self.get_deadband(attr_name):
+                            continue
+                    elif bool(v) == bool(last):
+                        continue
+                self.event_values[attr_name] = v
+                try:
+                    if v is None:
+                        v = float('nan') if ad in ('ai', 'ao') else False
+                        q = tango.AttrQuality.ATTR_INVALID
+                    else:
+                        q = tango.AttrQuality.ATTR_VALID
+                    t = time.time()
+                    self.push_change_event(attr_name, v, t, q)
+                    self.push_archive_event(attr_name, v, t, q)
+                except KeyboardInterrupt:
+                    raise
+                except:
+                    self.log_exception('Error pushing event for %s' % attr_name)
+        # packed digital banks
+        for ad in ET7000.bit_banks:
+            attr_name = ad + '_mask'
+            if attr_name not in self.dynamic_attributes:
+                continue
+            v = self.et.snapshot[ad]
+            if attr_name in self.event_values and self.event_values[attr_name] == v:
+                continue
+            self.event_values[attr_name] = v
+            try:
+                if v is None:
+                    self.push_change_event(attr_name, 0, time.time(), tango.AttrQuality.ATTR_INVALID)
+                else:
+                    self.push_change_event(attr_name, v)
+                    self.push_archive_event(attr_name, v)
+            except KeyboardInterrupt:
+                raise
+            except:
+                self.log_exception('Error pushing event for %s' % attr_name)
+
     def initialize_dynamic_attributes(self):
-        # with self.lock:
         if not hasattr(self, 'init_da') or not self.init_da:
             return
         nai = 0
@@ -315,8 +880,7 @@ class ET7000_Server(TangoServerPrototype):
                 msg = 'No attributes added for unknown device'
                 self.log_warning(msg)
                 self.set_state(DevState.FAULT, msg)
-                self.init_da = False
-                self.init_po = False
+                # attributes will be added by looping() when device is connected
                 return
             self.set_state(DevState.INIT, 'Attributes creation started')
             attr_name = ''
@@ -344,6 +908,7 @@ class ET7000_Server(TangoServerPrototype):
                             # add attr to device
                             self.add_attribute(attr)
                             self.dynamic_attributes[attr_name] = attr
+                            self.enable_events(attr_name)
                             nai += 1
                         else:
                             self.log_debug('Disabled attribute %s skipped', attr_name)
@@ -380,6 +945,7 @@ class ET7000_Server(TangoServerPrototype):
                                                           max_value=self.et.ao_max[k])
                             self.add_attribute(attr)
                             self.dynamic_attributes[attr_name] = attr
+                            self.enable_events(attr_name)
                             v = self.et.ao_read(k)
                             attr.get_attribute(self).set_write_value(v)
                             nao += 1
@@ -414,6 +980,7 @@ class ET7000_Server(TangoServerPrototype):
                                                       format='')
                         self.add_attribute(attr)
                         self.dynamic_attributes[attr_name] = attr
+                        self.enable_events(attr_name)
                         ndi += 1
                     msg = ' %d of %d digital inputs initialized' % (ndi, self.et.di_n)
                     if ndi != self.et.di_n:
@@ -445,6 +1012,7 @@ class ET7000_Server(TangoServerPrototype):
                                                       format='')
                         self.add_attribute(attr)
                         self.dynamic_attributes[attr_name] = attr
+                        self.enable_events(attr_name)
                         v = self.et.do_read(k)
                         attr.get_attribute(self).set_write_value(v)
                         ndo += 1
@@ -457,6 +1025,14 @@ class ET7000_Server(TangoServerPrototype):
                 raise
             except:
                 self.log_exception(self.logger, 'Exception adding %s', attr_name)
+            # whole bank attributes
+            try:
+                self.add_bank_attributes()
+                self.add_acquisition_attributes()
+            except KeyboardInterrupt:
+                raise
+            except:
+                self.log_exception('Exception adding bank attributes')
             # successful report
             msg = ''
             if self.et.ai_n > 0:
@@ -479,6 +1055,81 @@ class ET7000_Server(TangoServerPrototype):
         self.init_da = False
         return nai + nao + ndi + ndo
 
+    def add_bank_attributes(self):
+        # SPECTRUM attributes all_ai, all_ao, all_di, all_do for whole bank in one call
+        banks = (('ai', self.et.ai_n, float, 'analog inputs'),
+                 ('ao', self.et.ao_n, float, 'analog outputs'),
+                 ('di', self.et.di_n, tango.DevBoolean, 'digital inputs'),
+                 ('do', self.et.do_n, tango.DevBoolean, 'digital outputs'))
+        for ad, n, dtype, doc in banks:
+            attr_name = 'all_' + ad
+            if n <= 0 or hasattr(self, attr_name):
+                continue
+            if ad in ('ao', 'do'):
+                access = tango.AttrWriteType.READ_WRITE
+                fset = self.write_all
+            else:
+                access = tango.AttrWriteType.READ
+                fset = None
+            attr = tango.server.attribute(name=attr_name, dtype=dtype,
+                                          dformat=tango.AttrDataFormat.SPECTRUM,
+                                          access=access,
+                                          max_dim_x=n, max_dim_y=0,
+                                          fget=self.read_all,
+                                          fset=fset,
+                                          label=attr_name,
+                                          doc='All %s' % doc,
+                                          display_unit=1.0)
+            self.add_attribute(attr)
+            self.dynamic_attributes[attr_name] = attr
+        # packed digital banks and latched di edges
+        masks = (('di_mask', self.et.di_n, self.read_mask, None, 'All digital inputs, bit k is channel k'),
+                 ('di_rising', self.et.di_n, self.read_edges, None,
+                  'Digital inputs with rising edge since last read, bit k is channel k'),
+                 ('di_falling', self.et.di_n, self.read_edges, None,
+                  'Digital inputs with falling edge since last read, bit k is channel k'),
+                 ('do_mask', self.et.do_n, self.read_mask, self.write_mask, 'All digital outputs, bit k is channel k'))
+        for attr_name, n, fget, fset, doc in masks:
+            if n <= 0 or hasattr(self, attr_name):
+                continue
+            attr = tango.server.attribute(name=attr_name, dtype=tango.DevULong64,
+                                          dformat=tango.AttrDataFormat.SCALAR,
+                                          access=tango.AttrWriteType.READ if fset is None
+                                          else tango.AttrWriteType.READ_WRITE,
+                                          fget=fget,
+                                          fset=fset,
+                                          label=attr_name,
+                                          doc=doc,
+                                          format='%x')
+            self.add_attribute(attr)
+            self.dynamic_attributes[attr_name] = attr
+            if attr_name.endswith('_mask'):
+                self.enable_events(attr_name)
+
+    def add_acquisition_attributes(self):
+        # latest samples of continuous ai acquisition, rows are samples and columns are channels
+        if self.acquisition_capacity <= 0 or self.et.ai_n <= 0:
+            return
+        acquisition = (('ai_window', tango.AttrDataFormat.IMAGE, self.et.ai_n, self.acquisition_window, '',
+                        'Latest samples of continuous acquisition, row is sample, column is ai channel'),
+                       ('ai_window_time', tango.AttrDataFormat.SPECTRUM, self.acquisition_window, 0, 's',
+                        'Times of ai_window samples'),
+                       ('sample_rate', tango.AttrDataFormat.SCALAR, 0, 0, 'Hz',
+                        'Effective sample rate of continuous acquisition'))
+        for attr_name, dformat, dim_x, dim_y, unit, doc in acquisition:
+            if hasattr(self, attr_name):
+                continue
+            attr = tango.server.attribute(name=attr_name, dtype=float,
+                                          dformat=dformat,
+                                          access=tango.AttrWriteType.READ,
+                                          max_dim_x=dim_x, max_dim_y=dim_y,
+                                          fget=self.read_acquisition,
+                                          label=attr_name,
+                                          unit=unit,
+                                          doc=doc)
+            self.add_attribute(attr)
+            self.dynamic_attributes[attr_name] = attr
+
     def remove_dynamic_attributes(self):
         # removed = []
         for attr_name in self.dynamic_attributes:
@@ -497,25 +1148,26 @@ class ET7000_Server(TangoServerPrototype):
         self.init_da = True
 
     def is_connected(self):
-        if self.et is None or self.et.type == 0:
-            self.reconnect()
-        if self.et is None or self.et.type == 0:
-            self.error_time = time.time()
-            return False
-        if not self.et.is_open:
-            self.error_time = time.time()
-            return False
-        self.error_time = 0.0
-        return True
+        # no io here, reconnection is done in background
+        if self.connection_state == STATE_CONNECTED:
+            if self.et is not None and self.et.is_connected():
+                self.error_time = 0.0
+                return True
+            self.set_disconnected('Connection lost')
+        self.schedule_reconnect()
+        self.error_time = time.time()
+        return False
 
     def set_error_attribute_value(self, attr: tango.Attribute):
         v = None
-        if attr.get_data_format() == tango.DevBoolean:
+        if attr.get_data_type() == tango.DevBoolean:
             v = False
-        elif attr.get_data_format() == tango.DevDouble:
+        elif attr.get_data_type() == tango.DevDouble:
             v = float('nan')
-        if attr.get_data_type() == tango.SPECTRUM:
+        if attr.get_data_format() == tango.AttrDataFormat.SPECTRUM:
             v = [v]
+        elif attr.get_data_format() == tango.AttrDataFormat.IMAGE:
+            v = [[v]]
         attr.set_value(v)
         attr.set_quality(tango.AttrQuality.ATTR_INVALID)
         return v
@@ -533,7 +1185,11 @@ def looping():
     # logger.debug('loop entry')
     time.sleep(2.0)
     for dev in ET7000_Server.devices:
-            ET7000_Server.devices[dev].is_connected()
+        v = ET7000_Server.devices[dev]
+        # create attributes for devices connected in background
+        if v.is_connected() and v.init_da:
+            v.initialize_dynamic_attributes()
+            v.restore_polling()
 
 
 def post_init_callback():
@@ -0,0 +1,168 @@
+import os, sys
+if os.path.realpath('../TangoUtils') not in sys.path: sys.path.append(os.path.realpath('../TangoUtils'))
+
+import argparse
+import asyncio
+import random
+import struct
+
+from config_logger import config_logger
+from ET7000 import FakeET7000
+from ModbusTransport import MBAP_SIZE, mbap, pack_bits, unpack_bits
+
+# Modbus TCP simulator of ET-7026, ET-7015 and other FakeET7000 profiles for load testing without hardware.
+# Every module listens on its own localhost port, latency, jitter, lost responses
+# and dropped connections are injected per request.
+# Usage: python ET7000_Simulator.py --port 5020 --count 200 --type 7026,7015 --latency 0.002 --loss 0.001
+
+
+# Register map and request processing of one module, addresses are in 0/10000/30000/40000 notation
+class SimulatedModule:
+    def __init__(self, module_type='7026', latency=0.0, jitter=0.0, loss=0.0, disconnect=0.0):
+        self.module_type = module_type
+        self.registers = FakeET7000._client(type=module_type)
+        # response delay in seconds is latency plus uniform random in [0, jitter]
+        self.latency = latency
+        self.jitter = jitter
+        # probability of request without response and of connection closed by module
+        self.loss = loss
+        self.disconnect = disconnect
+        self.requests = 0
+        self.lost = 0
+        self.disconnects = 0
+
+    def read(self, prefix: int, addr: int, n: int):
+        values = self.registers.modbus_read(prefix, addr, n)
+        if values is None:
+            raise KeyError(prefix + addr)
+        return values
+
+    def write(self, prefix: int, addr: int, values):
+        self.registers.modbus_write(prefix, addr, len(values), values)
+
+    def process(self, pdu: bytes):
+        # response pdu for request pdu
+        fc = pdu[0]
+        try:
+            if fc in (1, 2):
+                addr, n = struct.unpack('>HH', pdu[1:5])
+                data = pack_bits(self.read(0 if fc == 1 else 10000, addr, n))
+                return struct.pack('>BB', fc, len(data)) + data
+            if fc in (3, 4):
+                addr, n = struct.unpack('>HH', pdu[1:5])
+                regs = self.read(40000 if fc == 3 else 30000, addr, n)
+                return struct.pack('>BB%dH' % n, fc, 2 * n, *[int(r) & 0xFFFF for r in regs])
+            if fc == 5:
+                addr, value = struct.unpack('>HH', pdu[1:5])
+                self.write(0, addr, [value == 0xFF00])
+                return pdu[:5]
+            if fc == 6:
+                addr, value = struct.unpack('>HH', pdu[1:5])
+                self.write(40000, addr, [value])
+                return pdu[:5]
+            if fc == 15:
+                addr, n = struct.unpack('>HH', pdu[1:5])
+                self.write(0, addr, unpack_bits(pdu[6:], n))
+                return pdu[:5]
+            if fc == 16:
+                addr, n = struct.unpack('>HH', pdu[1:5])
+                self.write(40000, addr, struct.unpack('>%dH' % n, pdu[6:6 + 2 * n]))
+                return pdu[:5]
+            # illegal function
+            return struct.pack('>BB', fc | 0x80, 1)
+        except (KeyError, IndexError, struct.error):
+            # illegal data address
+            return struct.pack('>BB', fc | 0x80, 2)
+
+    def delay(self):
+        if self.jitter > 0.0:
+            return self.latency + random.uniform(0.0, self.jitter)
+        return self.latency
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # serve one client connection, requests are answered in order of arrival like real module
+        try:
+            while True:
+                header = await reader.readexactly(MBAP_SIZE)
+                tid, pid, length, unit_id = struct.unpack('>HHHB', header)
+                if pid != 0 or length < 2:
+                    break
+                pdu = await reader.readexactly(length - 1)
+                self.requests += 1
+                if self.disconnect > 0.0 and random.random() < self.disconnect:
+                    self.disconnects += 1
+                    break
+                delay = self.delay()
+                if delay > 0.0:
+                    await asyncio.sleep(delay)
+                if self.loss > 0.0 and random.random() < self.loss:
+                    self.lost += 1
+                    continue
+                writer.write(mbap(tid, self.process(pdu), unit_id))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+# Many simulated modules on consecutive ports of one host served by one event loop
+class ET7000Simulator:
+    def __init__(self, host='127.0.0.1', port=5020, count=1, types=('7026',), logger=None, **kwargs):
+        # kwargs: latency, jitter, loss, disconnect of SimulatedModule
+        self.host = host
+        self.port = port
+        self.logger = logger or config_logger()
+        self.modules = [SimulatedModule(types[i % len(types)], **kwargs) for i in range(count)]
+        self.servers = []
+
+    async def start(self):
+        for i, module in enumerate(self.modules):
+            server = await asyncio.start_server(module.handle, self.host, self.port + i)
+            self.servers.append(server)
+        self.logger.info('%d simulated modules at %s:%d-%d', len(self.modules),
+                         self.host, self.port, self.port + len(self.modules) - 1)
+
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers = []
+
+    async def run(self):
+        await self.start()
+        try:
+            await asyncio.gather(*[server.serve_forever() for server in self.servers])
+        finally:
+            await self.stop()
+
+    def report(self):
+        return {self.port + i: {'type': m.module_type, 'requests': m.requests,
+                                'lost': m.lost, 'disconnects': m.disconnects}
+                for i, m in enumerate(self.modules)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ET-7000 Modbus TCP simulator')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5020, help='port of the first module')
+    parser.add_argument('--count', type=int, default=1, help='number of modules on consecutive ports')
+    parser.add_argument('--type', default='7026', help='module types used in turn, e.g. 7026,7015')
+    parser.add_argument('--profiles', default=None, help='json file with additional module register maps')
+    parser.add_argument('--latency', type=float, default=0.0, help='response delay, s')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random addition to delay, s')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability of lost response')
+    parser.add_argument('--disconnect', type=float, default=0.0, help='probability of dropped connection')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if args.profiles:
+        FakeET7000.load_profiles(args.profiles)
+    simulator = ET7000Simulator(args.host, args.port, args.count, args.type.split(','),
+                                latency=args.latency, jitter=args.jitter,
+                                loss=args.loss, disconnect=args.disconnect)
+    try:
+        asyncio.run(simulator.run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,845 @@
+import asyncio
+import math
+import selectors
+import socket
+import struct
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from threading import Condition, Lock, Thread, current_thread, local
+
+# modbus function codes
+READ_COILS = 0x01
+READ_DISCRETE_INPUTS = 0x02
+READ_HOLDING_REGISTERS = 0x03
+READ_INPUT_REGISTERS = 0x04
+WRITE_SINGLE_COIL = 0x05
+WRITE_SINGLE_REGISTER = 0x06
+WRITE_MULTIPLE_COILS = 0x0F
+WRITE_MULTIPLE_REGISTERS = 0x10
+
+FUNCTION_NAMES = {
+    READ_COILS: 'read_coils',
+    READ_DISCRETE_INPUTS: 'read_discrete_inputs',
+    READ_HOLDING_REGISTERS: 'read_holding_registers',
+    READ_INPUT_REGISTERS: 'read_input_registers',
+    WRITE_SINGLE_COIL: 'write_single_coil',
+    WRITE_SINGLE_REGISTER: 'write_single_register',
+    WRITE_MULTIPLE_COILS: 'write_multiple_coils',
+    WRITE_MULTIPLE_REGISTERS: 'write_multiple_registers',
+}
+
+WRITE_FUNCTIONS = (WRITE_SINGLE_COIL, WRITE_SINGLE_REGISTER, WRITE_MULTIPLE_COILS, WRITE_MULTIPLE_REGISTERS)
+
+# request priority classes, lower is served first
+PRIORITY_WRITE = 0
+PRIORITY_READ = 1
+PRIORITY_SCAN = 2
+PRIORITY_DIAGNOSTICS = 3
+PRIORITY_NAMES = ('write', 'read', 'scan', 'diagnostics')
+
+MBAP_SIZE = 7
+
+# latency histogram buckets: 4 per octave starting from 1 us, last bucket is about 100 s
+HISTOGRAM_BUCKETS_PER_OCTAVE = 4
+HISTOGRAM_BUCKETS = 108
+
+
+# ******** Modbus PDU encoding and decoding ***********
+def mbap(tid: int, pdu: bytes, unit_id=1):
+    return struct.pack('>HHHB', tid, 0, len(pdu) + 1, unit_id) + pdu
+
+
+def read_pdu(fc: int, addr: int, n: int):
+    return struct.pack('>BHH', fc, addr, n)
+
+
+def write_single_coil_pdu(addr: int, value):
+    return struct.pack('>BHH', WRITE_SINGLE_COIL, addr, 0xFF00 if value else 0x0000)
+
+
+def write_single_register_pdu(addr: int, value: int):
+    return struct.pack('>BHH', WRITE_SINGLE_REGISTER, addr, int(value) & 0xFFFF)
+
+
+def write_multiple_coils_pdu(addr: int, values):
+    data = pack_bits(values)
+    return struct.pack('>BHHB', WRITE_MULTIPLE_COILS, addr, len(values), len(data)) + data
+
+
+def write_multiple_registers_pdu(addr: int, values):
+    n = len(values)
+    return struct.pack('>BHHB%dH' % n, WRITE_MULTIPLE_REGISTERS, addr, n, 2 * n,
+                       *[int(v) & 0xFFFF for v in values])
+
+
+READ_FUNCTIONS = {
+    'read_coils': READ_COILS,
+    'read_discrete_inputs': READ_DISCRETE_INPUTS,
+    'read_holding_registers': READ_HOLDING_REGISTERS,
+    'read_input_registers': READ_INPUT_REGISTERS,
+    # bits packed to int, bit k is item k
+    'read_coils_packed': READ_COILS,
+    'read_discrete_inputs_packed': READ_DISCRETE_INPUTS,
+}
+
+# read functions of tables in 0/10000/30000/40000 address notation
+TABLE_READ_FUNCTIONS = {
+    0: 'read_coils',
+    10000: 'read_discrete_inputs',
+    30000: 'read_input_registers',
+    40000: 'read_holding_registers',
+}
+# max items of one read request by Modbus specification
+MAX_READ_BITS = 2000
+MAX_READ_REGISTERS = 125
+
+
+def address_table(addr: int):
+    # table prefix 0, 10000, 30000 or 40000 of address, None if address is out of range
+    if addr >= 40000:
+        table = 40000
+    elif addr >= 30000:
+        table = 30000
+    elif 10000 <= addr < 20000:
+        table = 10000
+    elif 0 <= addr < 10000:
+        table = 0
+    else:
+        return None
+    if addr - table > 0xFFFF:
+        return None
+    return table
+
+
+def plan_reads(addresses, gap=0):
+    # fewest read requests (method name, table, first, count) covering addresses in 0/10000/30000/40000 notation.
+    # Addresses of one table with up to gap unused addresses between them are read by one request
+    # within PDU limits, invalid addresses are skipped
+    tables = {}
+    for addr in set(addresses):
+        table = address_table(addr)
+        if table is not None:
+            tables.setdefault(table, []).append(addr - table)
+    plan = []
+    for table in sorted(tables):
+        name = TABLE_READ_FUNCTIONS[table]
+        limit = MAX_READ_BITS if table < 30000 else MAX_READ_REGISTERS
+        offsets = sorted(tables[table])
+        first = last = offsets[0]
+        for offset in offsets[1:]:
+            if offset - last - 1 <= gap and offset - first < limit:
+                last = offset
+            else:
+                plan.append((name, table, first, last - first + 1))
+                first = last = offset
+        plan.append((name, table, first, last - first + 1))
+    return plan
+
+
+def build_request(name: str, addr: int, arg=1):
+    # (function code, number of items, pdu) for client method name and its arguments
+    if name in READ_FUNCTIONS:
+        return READ_FUNCTIONS[name], arg, read_pdu(READ_FUNCTIONS[name], addr, arg)
+    if name == 'write_single_coil':
+        return WRITE_SINGLE_COIL, 1, write_single_coil_pdu(addr, arg)
+    if name == 'write_single_register':
+        return WRITE_SINGLE_REGISTER, 1, write_single_register_pdu(addr, arg)
+    if name == 'write_multiple_coils':
+        return WRITE_MULTIPLE_COILS, len(arg), write_multiple_coils_pdu(addr, arg)
+    if name == 'write_multiple_registers':
+        return WRITE_MULTIPLE_REGISTERS, len(arg), write_multiple_registers_pdu(addr, arg)
+    raise ValueError('Unknown modbus request %s' % name)
+
+
+def pack_bits(values):
+    data = bytearray((len(values) + 7) // 8)
+    for i, v in enumerate(values):
+        if v:
+            data[i >> 3] |= 1 << (i & 7)
+    return bytes(data)
+
+
+def unpack_bits(data: bytes, n: int):
+    return [bool((data[i >> 3] >> (i & 7)) & 1) for i in range(n)]
+
+
+def pack_mask(values):
+    # list of bits to int, bit k is values[k]
+    mask = 0
+    for i, v in enumerate(values):
+        if v:
+            mask |= 1 << i
+    return mask
+
+
+def unpack_mask(mask: int, n: int):
+    return [bool((mask >> i) & 1) for i in range(n)]
+
+
+def decode_pdu(fc: int, n: int, pdu: bytes, packed=False):
+    # result of request with function code fc for n items in pyModbusTCP style:
+    # list of bools or ints for read requests, True for write requests, None for errors.
+    # Bits are returned as int if packed is True
+    if not pdu or pdu[0] != fc:
+        return None
+    try:
+        if fc in (READ_COILS, READ_DISCRETE_INPUTS):
+            nb = (n + 7) // 8
+            if pdu[1] < nb or len(pdu) < 2 + nb:
+                return None
+            if packed:
+                return int.from_bytes(pdu[2:2 + nb], 'little') & ((1 << n) - 1)
+            return unpack_bits(pdu[2:], n)
+        if fc in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+            if pdu[1] != 2 * n:
+                return None
+            return list(struct.unpack('>%dH' % n, pdu[2:2 + 2 * n]))
+        return True
+    except (IndexError, struct.error):
+        return None
+
+
+# priority class of requests made by current thread inside "with request_priority(level):"
+_priority = local()
+
+
+@contextmanager
+def request_priority(level: int):
+    previous = getattr(_priority, 'level', None)
+    _priority.level = level
+    try:
+        yield
+    finally:
+        _priority.level = previous
+
+
+def current_priority(pdus):
+    # priority of context, or interactive write or read by function codes
+    level = getattr(_priority, 'level', None)
+    if level is not None:
+        return level
+    if any(pdu[0] in WRITE_FUNCTIONS for pdu in pdus):
+        return PRIORITY_WRITE
+    return PRIORITY_READ
+
+
+class FairLock:
+    # FIFO lock: waiting threads get the lock in order of arrival,
+    # so a thread doing back-to-back requests can not starve the others
+    def __init__(self):
+        self._condition = Condition(Lock())
+        self._next = 0
+        self._serving = 0
+
+    def __enter__(self):
+        with self._condition:
+            ticket = self._next
+            self._next += 1
+            while ticket != self._serving:
+                self._condition.wait()
+        return self
+
+    def __exit__(self, *args):
+        with self._condition:
+            self._serving += 1
+            self._condition.notify_all()
+
+
+# Latency histogram with logarithmic buckets, percentiles are accurate to about 20 %
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, dt: float):
+        us = dt * 1e6
+        i = 0
+        if us > 1.0:
+            i = min(int(math.log2(us) * HISTOGRAM_BUCKETS_PER_OCTAVE), HISTOGRAM_BUCKETS - 1)
+        self.counts[i] += 1
+        self.n += 1
+        self.total += dt
+        if dt > self.max:
+            self.max = dt
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.n += other.n
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, p: float):
+        # upper edge of bucket containing p-th percentile in seconds, limited by max
+        if self.n <= 0:
+            return 0.0
+        rank = p / 100.0 * self.n
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            cumulative += c
+            if cumulative >= rank and c > 0:
+                return min(2.0 ** ((i + 1) / HISTOGRAM_BUCKETS_PER_OCTAVE) * 1e-6, self.max)
+        return self.max
+
+    def report(self):
+        return {'count': self.n,
+                'mean': self.total / self.n if self.n > 0 else 0.0,
+                'p50': self.percentile(50.0),
+                'p99': self.percentile(99.0),
+                'max': self.max}
+
+
+# Request counters and latency histograms per function code of one connection
+class TransportStats:
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.function_errors = {}
+            self.requests = 0
+            self.timeouts = 0
+            self.errors = 0
+            # reopens of connection lost by previous request, requests are never repeated
+            self.reconnects = 0
+            # time in ModbusWorker queue by priority class
+            self.waits = {}
+            self.since = time.time()
+
+    def add(self, fc: int, dt: float):
+        with self.lock:
+            self.requests += 1
+            histogram = self.histograms.get(fc)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self.histograms[fc] = histogram
+            histogram.add(dt)
+
+    def add_error(self, fc: int, timeout=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += 1
+            self.function_errors[fc] = self.function_errors.get(fc, 0) + 1
+            if timeout:
+                self.timeouts += 1
+
+    def add_wait(self, level: int, dt: float):
+        with self.lock:
+            histogram = self.waits.get(level)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self.waits[level] = histogram
+            histogram.add(dt)
+
+    def wait_histogram(self, level: int):
+        with self.lock:
+            return LatencyHistogram().merge(self.waits.get(level, LatencyHistogram()))
+
+    def add_reconnect(self):
+        with self.lock:
+            self.reconnects += 1
+
+    def histogram(self, fc=None):
+        # histogram of function code fc or of all requests
+        with self.lock:
+            if fc is not None:
+                return LatencyHistogram().merge(self.histograms.get(fc, LatencyHistogram()))
+            total = LatencyHistogram()
+            for histogram in self.histograms.values():
+                total.merge(histogram)
+            return total
+
+    def error_rate(self):
+        with self.lock:
+            return self._error_rate()
+
+    def _error_rate(self):
+        if self.requests <= 0:
+            return 0.0
+        return self.errors / self.requests
+
+    def report(self):
+        with self.lock:
+            functions = {}
+            for fc in set(self.histograms) | set(self.function_errors):
+                report = self.histograms[fc].report() if fc in self.histograms else LatencyHistogram().report()
+                report['errors'] = self.function_errors.get(fc, 0)
+                functions[FUNCTION_NAMES.get(fc, str(fc))] = report
+            waits = {PRIORITY_NAMES[level]: h.report() for level, h in self.waits.items()}
+            result = {'requests': self.requests,
+                      'errors': self.errors,
+                      'timeouts': self.timeouts,
+                      'reconnects': self.reconnects,
+                      'error_rate': self._error_rate(),
+                      'since': self.since,
+                      'functions': functions,
+                      'waits': waits}
+        result.update(self.histogram().report())
+        return result
+
+
+# Modbus TCP client with the same API as pyModbusTCP ModbusClient.
+# Socket is non-blocking and waiting for response is done by selector,
+# which releases GIL while blocked, so no sleep is needed for other threads to run.
+# batch() pipelines several requests keeping up to window of them in flight,
+# responses are matched to requests by transaction id.
+class ModbusTransport:
+    def __init__(self, host: str, port=502, unit_id=1, timeout=0.5, auto_open=True, auto_close=False, **kwargs):
+        self.host = host
+        self.port = port
+        self.unit_id = unit_id
+        self.timeout = timeout
+        self.auto_open = auto_open
+        self.auto_close = auto_close
+        self.keepalive = kwargs.pop('keepalive', True)
+        self.window = max(1, kwargs.pop('window', 4))
+        self.lock = FairLock()
+        self.sock = None
+        self.selector = None
+        self.tid = 0
+        self.last_error = ''
+        self.stats = TransportStats()
+        self.lost = False
+
+    def __del__(self):
+        try:
+            self._close()
+        except:
+            pass
+
+    @property
+    def is_open(self):
+        return self.sock is not None
+
+    def open(self):
+        with self.lock:
+            return self._open()
+
+    def close(self):
+        with self.lock:
+            self._close()
+        return True
+
+    def _open(self):
+        if self.sock is not None:
+            return True
+        try:
+            sock = socket.create_connection((self.host, self.port), self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.keepalive:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                # detect dead peer in ~10 s where options are available
+                for option, value in (('TCP_KEEPIDLE', 5), ('TCP_KEEPINTVL', 1), ('TCP_KEEPCNT', 5)):
+                    if hasattr(socket, option):
+                        sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+            sock.setblocking(False)
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(sock, selectors.EVENT_READ)
+            self.sock = sock
+            return True
+        except OSError as ex:
+            self.last_error = str(ex)
+            self.sock = None
+            return False
+
+    def _close(self):
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _next_tid(self):
+        self.tid = (self.tid + 1) & 0xFFFF
+        return self.tid
+
+    def _wait(self, event, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0.0:
+            raise TimeoutError('timeout')
+        self.selector.modify(self.sock, event)
+        if not self.selector.select(remaining):
+            raise TimeoutError('timeout')
+
+    def _send(self, data: bytes, deadline):
+        view = memoryview(data)
+        while view:
+            try:
+                sent = self.sock.send(view)
+                view = view[sent:]
+            except BlockingIOError:
+                self._wait(selectors.EVENT_WRITE, deadline)
+
+    def _recv(self, n: int, deadline):
+        buf = bytearray()
+        while len(buf) < n:
+            try:
+                data = self.sock.recv(n - len(buf))
+            except BlockingIOError:
+                self._wait(selectors.EVENT_READ, deadline)
+                continue
+            if not data:
+                raise ConnectionError('connection closed by peer')
+            buf += data
+        return bytes(buf)
+
+    def _recv_frame(self, deadline):
+        # returns (transaction id, pdu)
+        tid, pid, length, unit_id = struct.unpack('>HHHB', self._recv(MBAP_SIZE, deadline))
+        if pid != 0 or length < 2:
+            raise ConnectionError('wrong MBAP header')
+        return tid, self._recv(length - 1, deadline)
+
+    def transaction(self, pdu: bytes):
+        # send request pdu and return response pdu, None on error
+        return self.transactions([pdu])[0]
+
+    def transactions(self, pdus):
+        # send request pdus pipelined and return list of response pdus, None for failed requests
+        results = [None] * len(pdus)
+        with self.lock:
+            if self.sock is None:
+                if self.lost:
+                    self.stats.add_reconnect()
+                if not (self.auto_open and self._open()):
+                    for pdu in pdus:
+                        self.stats.add_error(pdu[0])
+                    return results
+                self.lost = False
+            # pending requests: transaction id -> (index, time sent)
+            pending = {}
+            i = 0
+            try:
+                while i < len(pdus) or pending:
+                    frames = []
+                    t0 = time.monotonic()
+                    while i < len(pdus) and len(pending) < self.window:
+                        tid = self._next_tid()
+                        pending[tid] = (i, t0)
+                        frames.append(mbap(tid, pdus[i], self.unit_id))
+                        i += 1
+                    deadline = t0 + self.timeout
+                    if frames:
+                        self._send(b''.join(frames), deadline)
+                    tid, response = self._recv_frame(deadline)
+                    # late responses to previous requests are skipped
+                    request = pending.pop(tid, None)
+                    if request is not None:
+                        k, t = request
+                        results[k] = response
+                        fc = pdus[k][0]
+                        if response and response[0] == fc:
+                            self.stats.add(fc, time.monotonic() - t)
+                        else:
+                            # modbus exception response
+                            self.stats.add_error(fc)
+            except (OSError, TimeoutError) as ex:
+                self.last_error = str(ex)
+                timeout = isinstance(ex, TimeoutError)
+                for k, t in pending.values():
+                    self.stats.add_error(pdus[k][0], timeout)
+                for pdu in pdus[i:]:
+                    self.stats.add_error(pdu[0])
+                self._close()
+                self.lost = True
+                return results
+            if self.auto_close:
+                self._close()
+            return results
+
+    def batch(self, calls):
+        # calls: list of (method name, address, count or value), e.g. ('read_coils', 0, 8)
+        requests = [build_request(*call) for call in calls]
+        responses = self.transactions([r[2] for r in requests])
+        return [decode_pdu(fc, n, pdu, call[0].endswith('_packed'))
+                for call, (fc, n, _), pdu in zip(calls, requests, responses)]
+
+    def _request(self, fc: int, n: int, pdu: bytes, packed=False):
+        return decode_pdu(fc, n, self.transaction(pdu), packed)
+
+    def read_coils(self, addr: int, n=1):
+        return self._request(*build_request('read_coils', addr, n))
+
+    def read_discrete_inputs(self, addr: int, n=1):
+        return self._request(*build_request('read_discrete_inputs', addr, n))
+
+    def read_coils_packed(self, addr: int, n=1):
+        return self._request(*build_request('read_coils_packed', addr, n), packed=True)
+
+    def read_discrete_inputs_packed(self, addr: int, n=1):
+        return self._request(*build_request('read_discrete_inputs_packed', addr, n), packed=True)
+
+    def read_holding_registers(self, addr: int, n=1):
+        return self._request(*build_request('read_holding_registers', addr, n))
+
+    def read_input_registers(self, addr: int, n=1):
+        return self._request(*build_request('read_input_registers', addr, n))
+
+    def write_single_coil(self, addr: int, value):
+        return self._request(*build_request('write_single_coil', addr, value))
+
+    def write_single_register(self, addr: int, value: int):
+        return self._request(*build_request('write_single_register', addr, value))
+
+    def write_multiple_coils(self, addr: int, values):
+        return self._request(*build_request('write_multiple_coils', addr, values))
+
+    def write_multiple_registers(self, addr: int, values):
+        return self._request(*build_request('write_multiple_registers', addr, values))
+
+
+# Queues of requests by priority class. Highest priority is served first,
+# but request waiting longer than starvation_limit is served before any other.
+class RequestLanes:
+    def __init__(self, starvation_limit=0.5):
+        self.starvation_limit = starvation_limit
+        self.condition = Condition()
+        # every lane holds (time queued, request)
+        self.lanes = [deque() for level in PRIORITY_NAMES]
+        self.stopped = False
+
+    def depths(self):
+        return [len(lane) for lane in self.lanes]
+
+    def put(self, level: int, request):
+        with self.condition:
+            self.lanes[level].append((time.monotonic(), request))
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def _next(self, now):
+        # lane to serve next, None if all are empty
+        oldest = None
+        for level, lane in enumerate(self.lanes):
+            if lane and now - lane[0][0] > self.starvation_limit and \
+                    (oldest is None or lane[0][0] < self.lanes[oldest][0][0]):
+                oldest = level
+        if oldest is not None:
+            return oldest
+        for level, lane in enumerate(self.lanes):
+            if lane:
+                return level
+        return None
+
+    def get(self, max_pdus: int):
+        # list of (level, time queued, request) of one priority class with up to max_pdus pdus
+        # (at least one request), waits for requests, None if lanes are stopped and empty.
+        # Classes are not mixed, so responses to urgent requests are not held by a round of slow ones
+        with self.condition:
+            while not self.stopped and not any(self.lanes):
+                self.condition.wait()
+            now = time.monotonic()
+            first = self._next(now)
+            if first is None:
+                return None
+            result = []
+            n = 0
+            lane = self.lanes[first]
+            while lane and self._next(now) == first and (n == 0 or n + len(lane[0][1][0]) <= max_pdus):
+                t, request = lane.popleft()
+                result.append((first, t, request))
+                n += len(request[0])
+            return result
+
+
+# ModbusTransport with connection owned by one I/O thread.
+# Callers put requests to priority lanes and wait for their futures, synchronous methods are unchanged.
+# Requests waiting in the lanes are sent together pipelined, up to window of them per round,
+# so a write waits for at most one round of lower priority requests.
+class ModbusWorker(ModbusTransport):
+    def __init__(self, host: str, port=502, unit_id=1, timeout=0.5, auto_open=True, auto_close=False, **kwargs):
+        self.starvation_limit = kwargs.pop('starvation_limit', 0.5)
+        # max number of requests sent in one pipelined round, default is window
+        max_batch = kwargs.pop('max_batch', None)
+        super().__init__(host, port, unit_id, timeout, auto_open, auto_close, **kwargs)
+        self.max_batch = max_batch or self.window
+        self.thread_lock = Lock()
+        self.lanes = None
+        self.thread = None
+
+    def submit(self, pdus, level=None):
+        # Future with list of response pdus for request pdus, level - priority class,
+        # by default from request_priority context or from function codes
+        if level is None:
+            level = current_priority(pdus)
+        future = Future()
+        with self.thread_lock:
+            if self.thread is None:
+                # every thread has its own lanes, so stopped thread never takes new requests
+                self.lanes = RequestLanes(self.starvation_limit)
+                self.thread = Thread(target=self._run, args=(self.lanes,),
+                                     name='ModbusWorker %s:%s' % (self.host, self.port), daemon=True)
+                self.thread.start()
+            self.lanes.put(level, (pdus, future))
+        return future
+
+    def transactions(self, pdus):
+        if current_thread() is self.thread:
+            return super().transactions(pdus)
+        return self.submit(pdus).result()
+
+    def queue_depths(self):
+        # number of waiting requests by priority class
+        lanes = self.lanes
+        if lanes is None:
+            return [0] * len(PRIORITY_NAMES)
+        return lanes.depths()
+
+    def close(self):
+        # connection is closed by worker after queued requests, thread is started again by next request
+        with self.thread_lock:
+            if self.thread is not None:
+                self.lanes.stop()
+                self.thread = None
+                return True
+        return super().close()
+
+    def _run(self, lanes: RequestLanes):
+        while True:
+            items = lanes.get(self.max_batch)
+            if items is None:
+                break
+            now = time.monotonic()
+            for level, t, request in items:
+                self.stats.add_wait(level, now - t)
+            pdus = [pdu for level, t, request in items for pdu in request[0]]
+            try:
+                results = super().transactions(pdus)
+            except Exception as ex:
+                for level, t, request in items:
+                    request[1].set_exception(ex)
+                continue
+            i = 0
+            for level, t, (request_pdus, future) in items:
+                future.set_result(results[i:i + len(request_pdus)])
+                i += len(request_pdus)
+        super().close()
+
+
+# asyncio Modbus TCP client with the same request methods as ModbusTransport
+class AsyncModbusTransport:
+    def __init__(self, host: str, port=502, unit_id=1, timeout=0.5, auto_open=True, **kwargs):
+        self.host = host
+        self.port = port
+        self.unit_id = unit_id
+        self.timeout = timeout
+        self.auto_open = auto_open
+        self.lock = None
+        self.reader = None
+        self.writer = None
+        self.tid = 0
+        self.last_error = ''
+
+    @property
+    def is_open(self):
+        return self.writer is not None
+
+    async def open(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            return await self._open()
+
+    async def close(self):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            await self._close()
+        return True
+
+    async def _open(self):
+        if self.writer is not None:
+            return True
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+            sock = self.writer.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            return True
+        except (OSError, asyncio.TimeoutError) as ex:
+            self.last_error = str(ex)
+            self.reader = None
+            self.writer = None
+            return False
+
+    async def _close(self):
+        if self.writer is not None:
+            writer = self.writer
+            self.reader = None
+            self.writer = None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def _recv_frame(self):
+        header = await self.reader.readexactly(MBAP_SIZE)
+        tid, pid, length, unit_id = struct.unpack('>HHHB', header)
+        if pid != 0 or length < 2:
+            raise ConnectionError('wrong MBAP header')
+        return tid, await self.reader.readexactly(length - 1)
+
+    async def _exchange(self, tid, frame):
+        self.writer.write(frame)
+        await self.writer.drain()
+        while True:
+            rtid, response = await self._recv_frame()
+            if rtid == tid:
+                return response
+
+    async def transaction(self, pdu: bytes):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.writer is None and not (self.auto_open and await self._open()):
+                return None
+            self.tid = (self.tid + 1) & 0xFFFF
+            try:
+                return await asyncio.wait_for(self._exchange(self.tid, mbap(self.tid, pdu, self.unit_id)),
+                                              self.timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as ex:
+                self.last_error = str(ex)
+                await self._close()
+                return None
+
+    async def _request(self, fc: int, n: int, pdu: bytes):
+        return decode_pdu(fc, n, await self.transaction(pdu))
+
+    async def read_coils(self, addr: int, n=1):
+        return await self._request(*build_request('read_coils', addr, n))
+
+    async def read_discrete_inputs(self, addr: int, n=1):
+        return await self._request(*build_request('read_discrete_inputs', addr, n))
+
+    async def read_holding_registers(self, addr: int, n=1):
+        return await self._request(*build_request('read_holding_registers', addr, n))
+
+    async def read_input_registers(self, addr: int, n=1):
+        return await self._request(*build_request('read_input_registers', addr, n))
+
+    async def write_single_coil(self, addr: int, value):
+        return await self._request(*build_request('write_single_coil', addr, value))
+
+    async def write_single_register(self, addr: int, value: int):
+        return await self._request(*build_request('write_single_register', addr, value))
+
+    async def write_multiple_coils(self, addr: int, values):
+        return await self._request(*build_request('write_multiple_coils', addr, values))
+
+    async def write_multiple_registers(self, addr: int, values):
+        return await self._request(*build_request('write_multiple_registers', addr, values))
@@ -0,0 +1,84 @@
+from threading import Lock
+
+import numpy as np
+
+
+# Preallocated ring buffer of fixed width rows with timestamps.
+# One writer thread appends, readers get copies of the latest rows in chronological order.
+class RingBuffer:
+    def __init__(self, capacity: int, width: int, dtype=np.float64):
+        self.capacity = max(1, int(capacity))
+        self.width = width
+        self.data = np.zeros((self.capacity, width), dtype=dtype)
+        self.times = np.zeros(self.capacity)
+        # total number of appended rows, next row goes to count % capacity
+        self.count = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+
+    def append(self, row, t: float):
+        with self.lock:
+            i = self.count % self.capacity
+            self.data[i] = row
+            self.times[i] = t
+            self.count += 1
+
+    def _indexes(self, n):
+        # indexes of the last n rows in chronological order, lock must be held
+        n = min(len(self), self.capacity if n is None else n)
+        return np.arange(self.count - n, self.count) % self.capacity
+
+    def latest(self, n=None):
+        # (times, rows) of the last n rows, all kept rows if n is None
+        with self.lock:
+            k = self._indexes(n)
+            return self.times[k], self.data[k]
+
+    def between(self, t0: float, t1: float, column=None):
+        # (times, rows) with t0 < time <= t1, only one column of rows if column is given
+        with self.lock:
+            k = self._indexes(None)
+            times = self.times[k]
+            k = k[(times > t0) & (times <= t1)]
+            if column is None:
+                return self.times[k], self.data[k]
+            return self.times[k], self.data[k, column]
+
+    def rate(self, n=None):
+        # average rate of appends over the last n rows, 1/s
+        with self.lock:
+            k = self._indexes(n)
+            if len(k) < 2:
+                return 0.0
+            dt = self.times[k[-1]] - self.times[k[0]]
+        if dt <= 0.0:
+            return 0.0
+        return (len(k) - 1) / dt
+
+
+def decimate(times, values, n: int, t0=None, t1=None):
+    # split [t0, t1] into n equal time bins and return (bin centers, min, max, mean) of values in each bin,
+    # empty bins are skipped. times must be sorted, values is 1-D array of the same length
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if len(times) <= 0 or n <= 0:
+        empty = np.zeros(0)
+        return empty, empty, empty, empty
+    t0 = times[0] if t0 is None else t0
+    t1 = times[-1] if t1 is None else t1
+    width = (t1 - t0) / n if t1 > t0 else 1.0
+    bins = np.clip(((times - t0) / width).astype(np.int64), 0, n - 1)
+    # bins are non decreasing, starts are indexes of first sample of every nonempty bin
+    starts = np.flatnonzero(np.diff(bins, prepend=-1))
+    counts = np.diff(np.append(starts, len(bins)))
+    centers = t0 + (bins[starts] + 0.5) * width
+    return (centers,
+            np.minimum.reduceat(values, starts),
+            np.maximum.reduceat(values, starts),
+            np.add.reduceat(values, starts) / counts)
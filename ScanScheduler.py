@@ -0,0 +1,219 @@
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+
+from log_exception import log_exception
+
+
+class ScanJob:
+    def __init__(self, name, function, period: float):
+        self.name = name
+        self.function = function
+        self.period = period
+        self.next_time = time.monotonic()
+        self.busy = False
+        self.count = 0
+        self.errors = 0
+        self.overruns = 0
+        self.last_start = 0.0
+        self.last_duration = 0.0
+        self.interval = 0.0
+
+    def requested_rate(self):
+        if self.period > 0.0:
+            return 1.0 / self.period
+        return 0.0
+
+    def achieved_rate(self):
+        # rate from averaged interval between scan starts, decays if scans stopped
+        if self.interval <= 0.0 or self.last_start <= 0.0:
+            return 0.0
+        return 1.0 / max(self.interval, time.monotonic() - self.last_start)
+
+    def report(self):
+        return {'requested_rate': self.requested_rate(),
+                'achieved_rate': self.achieved_rate(),
+                'last_duration': self.last_duration,
+                'count': self.count,
+                'errors': self.errors,
+                'overruns': self.overruns}
+
+
+# Runs scan functions of many devices concurrently on bounded thread pool, each with its own period.
+# Job is not resubmitted while its previous scan is running, so slow or dead device
+# occupies only one worker and does not delay the others.
+# Long blocking one-shot jobs (reconnections) run on separate small pool and never take scan workers.
+class ScanScheduler:
+    def __init__(self, workers=8, logger=None, background_workers=4):
+        self.logger = logger
+        self.jobs = {}
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ScanScheduler')
+        self.background = ThreadPoolExecutor(max_workers=background_workers,
+                                             thread_name_prefix='ScanSchedulerBackground')
+        self.thread = None
+        self.running = False
+
+    def add(self, name, function, period: float):
+        with self.lock:
+            self.jobs[name] = ScanJob(name, function, period)
+        self.wakeup.set()
+
+    def remove(self, name):
+        with self.lock:
+            self.jobs.pop(name, None)
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.running = True
+        self.thread = Thread(target=self._loop, name='ScanScheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, function, *args):
+        # run function once on the pool
+        return self.executor.submit(self._call, function, *args)
+
+    def submit_background(self, function, *args):
+        # run function once on the background pool
+        return self.background.submit(self._call, function, *args)
+
+    def _call(self, function, *args):
+        try:
+            return function(*args)
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, 'Exception in %s' % getattr(function, '__name__', function))
+
+    def report(self, name=None):
+        with self.lock:
+            if name is not None:
+                job = self.jobs.get(name)
+                return job.report() if job else {}
+            return {n: j.report() for n, j in self.jobs.items()}
+
+    def _loop(self):
+        while self.running:
+            now = time.monotonic()
+            wait = 1.0
+            with self.lock:
+                for job in self.jobs.values():
+                    if job.busy or job.period <= 0.0:
+                        continue
+                    if now >= job.next_time:
+                        job.busy = True
+                        self.executor.submit(self._run, job)
+                    else:
+                        wait = min(wait, job.next_time - now)
+            self.wakeup.wait(wait)
+            self.wakeup.clear()
+
+    def _run(self, job: ScanJob):
+        t0 = time.monotonic()
+        if job.last_start > 0.0:
+            interval = t0 - job.last_start
+            job.interval = interval if job.interval <= 0.0 else 0.9 * job.interval + 0.1 * interval
+        job.last_start = t0
+        try:
+            job.function()
+        except KeyboardInterrupt:
+            raise
+        except:
+            job.errors += 1
+            log_exception(self.logger, 'Scan %s exception' % job.name)
+        t1 = time.monotonic()
+        job.count += 1
+        job.last_duration = t1 - t0
+        job.next_time += job.period
+        if job.next_time < t1:
+            # scan took longer than period, skip missed cycles
+            job.overruns += 1
+            job.next_time = t1
+        job.busy = False
+        self.wakeup.set()
+
+
+# Scan period of one bank adapted to rate of change of its channels.
+# Period is chosen so that channels change by about resolution (fraction of channel span) between reads:
+# it drops at once when signal moves faster and grows by backoff factor per read when it is quiet.
+class AdaptiveRate:
+    def __init__(self, min_period: float, max_period: float, resolution=0.005, backoff=1.5):
+        self.min_period = min_period
+        self.max_period = max(max_period, min_period)
+        self.resolution = resolution
+        self.backoff = backoff
+        self.period = min_period
+        self.next_time = 0.0
+        self.last_values = None
+        self.last_time = 0.0
+        # max rate of change of channels, span fraction per second
+        self.activity = 0.0
+
+    def update(self, values, t: float, spans=None):
+        # values of bank channels read at time t, spans - channel full scales, 1.0 if None
+        if values is not None and self.last_values is not None and t > self.last_time:
+            activity = 0.0
+            for k, v in enumerate(values):
+                v0 = self.last_values[k]
+                if v is None or v0 is None or math.isnan(v) or math.isnan(v0):
+                    continue
+                span = spans[k] if spans is not None and spans[k] > 0.0 else 1.0
+                activity = max(activity, abs(v - v0) / span)
+            self.activity = activity / (t - self.last_time)
+            if self.activity > 0.0:
+                target = self.resolution / self.activity
+            else:
+                target = self.max_period
+            if target < self.period:
+                self.period = target
+            else:
+                self.period = min(self.period * self.backoff, target)
+            self.period = min(max(self.period, self.min_period), self.max_period)
+        if values is not None:
+            self.last_values = list(values)
+            self.last_time = t
+        self.next_time = t + self.period
+        return self.period
+
+
+# Adaptive periods of several banks of one device under common budget of reads per second
+class AdaptiveScan:
+    def __init__(self, banks, min_period: float, max_period: float, budget=0.0, resolution=0.005):
+        self.rates = {bank: AdaptiveRate(min_period, max_period, resolution) for bank in banks}
+        # max reads per second of all banks, 0.0 - no limit
+        self.budget = budget
+
+    def due(self, now: float):
+        # banks which have to be read now
+        return [bank for bank, rate in self.rates.items() if now >= rate.next_time]
+
+    def update(self, bank: str, values, t: float, spans=None):
+        self.rates[bank].update(values, t, spans)
+        self._apply_budget()
+
+    def _apply_budget(self):
+        # slow down all banks proportionally if total read rate exceeds budget
+        if self.budget <= 0.0:
+            return
+        load = sum(1.0 / r.period for r in self.rates.values())
+        if load <= self.budget:
+            return
+        factor = load / self.budget
+        for r in self.rates.values():
+            period = min(r.period * factor, r.max_period)
+            r.next_time += period - r.period
+            r.period = period
+
+    def report(self):
+        return {bank: {'period': r.period, 'rate': 1.0 / r.period, 'activity': r.activity}
+                for bank, r in self.rates.items()}
@@ -0,0 +1,62 @@
+import time
+from threading import Event, Lock
+
+from log_exception import log_exception
+
+
+class _Request:
+    def __init__(self, channel, value):
+        self.channel = channel
+        self.value = value
+        self.done = Event()
+        self.result = False
+
+
+# Merges channel writes arriving within window into one call of flush({channel: value, ...}).
+# First writer waits for the window and flushes the batch for all waiting writers,
+# every writer gets result of the write of its own channel.
+class WriteCoalescer:
+    def __init__(self, flush, window=0.005, timeout=5.0, logger=None):
+        self.flush = flush
+        self.window = window
+        self.timeout = timeout
+        self.logger = logger
+        self.lock = Lock()
+        self.pending = []
+        self.collecting = False
+
+    def write(self, channel, value):
+        request = _Request(channel, value)
+        with self.lock:
+            self.pending.append(request)
+            leader = not self.collecting
+            self.collecting = True
+        if leader:
+            time.sleep(self.window)
+            with self.lock:
+                batch = self.pending
+                self.pending = []
+                self.collecting = False
+            self._flush(batch)
+        if not request.done.wait(self.timeout):
+            return False
+        return request.result
+
+    def _flush(self, batch):
+        # later write to the same channel wins
+        values = {}
+        for r in batch:
+            values[r.channel] = r.value
+        try:
+            result = self.flush(values)
+        except KeyboardInterrupt:
+            raise
+        except:
+            log_exception(self.logger, 'Coalesced write exception')
+            result = False
+        for r in batch:
+            if isinstance(result, dict):
+                r.result = bool(result.get(r.channel, False))
+            else:
+                r.result = bool(result)
+            r.done.set()
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# modules of the server are in repository root, TangoUtils is next to repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(os.path.dirname(ROOT), 'TangoUtils')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture
+def stand_in():
+    # Modbus TCP server with one simulated ET-7026 on free localhost port
+    from ET7000_Benchmark import ModbusStandIn
+    server = ModbusStandIn().start()
+    yield server
+    server.stop()
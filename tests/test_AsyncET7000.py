@@ -0,0 +1,47 @@
+import asyncio
+
+from AsyncET7000 import AsyncET7000
+from ET7000 import ET7000
+
+
+def test_async_device_matches_sync_driver(stand_in):
+    et = ET7000('127.0.0.1', port=stand_in.port)
+
+    async def read():
+        aet = await AsyncET7000.connect('127.0.0.1', port=stand_in.port)
+        try:
+            return aet.type, aet.ai_n, aet.do_n, await aet.ai_read(), await aet.do_read()
+        finally:
+            await aet.close()
+
+    try:
+        assert asyncio.run(read()) == (et.type, et.ai_n, et.do_n, et.ai_read(), et.do_read())
+    finally:
+        et.__del__()
+
+
+def test_async_devices_are_read_concurrently(stand_in):
+    async def read_all(n):
+        devices = await asyncio.gather(*[AsyncET7000.connect('127.0.0.1', port=stand_in.port)
+                                         for i in range(n)])
+        try:
+            return await asyncio.gather(*[et.ai_read() for et in devices])
+        finally:
+            for et in devices:
+                await et.close()
+
+    results = asyncio.run(read_all(4))
+    assert len(results) == 4
+    assert all(r == results[0] and len(r) == 6 for r in results)
+
+
+def test_async_write_and_read_back(stand_in):
+    async def write_read():
+        et = await AsyncET7000.connect('127.0.0.1', port=stand_in.port)
+        try:
+            assert await et.do_write_channel(1, True)
+            return await et.do_read_channel(1)
+        finally:
+            await et.close()
+
+    assert asyncio.run(write_read()) is True
@@ -0,0 +1,37 @@
+import math
+
+import numpy as np
+
+from ET7000 import ET7000, ConversionTable
+
+# all ranges including current ones
+RANGES = list(ET7000.ranges)
+CODES = [0, 1, 0x1234, 0x7FFE, 0x7FFF, 0x8000, 0x8001, 0xC000, 0xFFFE, 0xFFFF]
+
+
+def test_values_match_scalar_conversion():
+    table = ConversionTable(RANGES)
+    for code in CODES:
+        values = table.values([code] * len(RANGES))
+        for k, r in enumerate(RANGES):
+            expected = ET7000.ai_convert_function(r)(code)
+            assert math.isclose(values[k], expected, rel_tol=1e-9, abs_tol=1e-12), (hex(r), code)
+            assert math.isclose(table.value(k, code), expected, rel_tol=1e-9, abs_tol=1e-12)
+
+
+def test_codes_match_scalar_conversion():
+    table = ConversionTable(RANGES)
+    for k, r in enumerate(RANGES):
+        convert = ET7000.ao_convert_function(r)
+        for value in np.linspace(table.v_min[k], table.v_max[k], 21):
+            assert table.codes(np.full(len(RANGES), value))[k] == convert(value), (hex(r), value)
+            assert table.code(k, value) == convert(value)
+
+
+def test_values_of_2d_codes_and_masks():
+    table = ConversionTable([0x07, 0x08, 0x09], masks=[True, False, True])
+    codes = np.array([[0, 0x4000, 0x7FFF], [0x8000, 0xFFFF, 1]], dtype=np.uint16)
+    values = table.values(codes)
+    assert values.shape == (2, 3)
+    assert np.isnan(values[:, 1]).all()
+    assert np.allclose(values[:, [0, 2]], [table.values(row)[[0, 2]] for row in codes])
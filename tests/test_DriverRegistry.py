@@ -0,0 +1,88 @@
+from threading import Thread
+
+from ET7000 import DriverRegistry, FakeET7000
+
+
+def fake_factory(host, port=502, **kwargs):
+    return FakeET7000(host, port=port, type='7026', **kwargs)
+
+
+def offline_factory(host, port=502, **kwargs):
+    # driver of module which did not answer
+    et = fake_factory(host, port, **kwargs)
+    et.type = 0
+    return et
+
+
+def test_driver_is_shared_and_released_by_last_user():
+    first = DriverRegistry.acquire('shared', 1502, fake_factory)
+    second = DriverRegistry.acquire('shared', 1502, fake_factory)
+    other = DriverRegistry.acquire('shared', 1503, fake_factory)
+    try:
+        assert first is second and first is not other
+        assert DriverRegistry.users(first) == 2
+        DriverRegistry.release(second)
+        assert DriverRegistry.users(first) == 1
+        DriverRegistry.release(first)
+        assert DriverRegistry.users(first) == 0
+        assert DriverRegistry.acquire('shared', 1502, fake_factory) is not first
+    finally:
+        DriverRegistry.release(other)
+        DriverRegistry.release(DriverRegistry.entries[('shared', 1502)][0])
+    assert ('shared', 1502) not in DriverRegistry.entries
+
+
+def test_undiscovered_driver_is_replaced():
+    offline = DriverRegistry.acquire('replace', 1502, offline_factory)
+    driver = None
+    try:
+        assert offline.type == 0
+        driver = DriverRegistry.acquire('replace', 1502, fake_factory)
+        assert driver is not offline and driver.type != 0
+        # release of replaced driver does not touch the new one
+        DriverRegistry.release(offline)
+        assert DriverRegistry.users(driver) == 1
+    finally:
+        if driver is not None:
+            DriverRegistry.release(driver)
+
+
+def test_concurrent_acquire_creates_one_shared_driver():
+    drivers = []
+    threads = [Thread(target=lambda: drivers.append(DriverRegistry.acquire('concurrent', 1502, fake_factory)))
+               for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(d is drivers[0] for d in drivers)
+    assert DriverRegistry.users(drivers[0]) == 8
+    for d in drivers:
+        DriverRegistry.release(d)
+    assert DriverRegistry.users(drivers[0]) == 0
+
+
+def test_users_of_one_driver_share_write_coalescer():
+    first = DriverRegistry.acquire('writer', 1502, fake_factory)
+    second = DriverRegistry.acquire('writer', 1502, fake_factory)
+    try:
+        writer = DriverRegistry.writer(first, 'do', 0.05)
+        assert DriverRegistry.writer(second, 'do', 0.01) is writer
+        assert DriverRegistry.writer(first, 'ao', 0.05) is not writer
+        calls = []
+        write_channels = first.do_write_channels
+        writer.flush = lambda values: calls.append(dict(values)) or write_channels(values)
+        results = []
+        threads = [Thread(target=lambda k=k: results.append(writer.write(k, True))) for k in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == [True, True] and calls == [{0: True, 1: True}]
+        assert second.do_read() == [True, True]
+    finally:
+        DriverRegistry.release(first)
+        DriverRegistry.release(second)
+    # driver not in registry gets its own coalescer
+    et = fake_factory('writer', 1502)
+    assert DriverRegistry.writer(et, 'ao', 0.05) is not DriverRegistry.writer(et, 'ao', 0.05)
@@ -0,0 +1,186 @@
+import os
+import time
+
+import numpy as np
+
+from ET7000 import ET7000, FakeET7000
+
+
+class CallCounter:
+    # counts calls of client read method
+    def __init__(self, client, name):
+        self.count = 0
+        self.function = getattr(client, name)
+        setattr(client, name, self)
+
+    def __call__(self, *args):
+        self.count += 1
+        return self.function(*args)
+
+
+def test_scan_fills_snapshot_of_all_banks():
+    et = FakeET7000('fake', type='7026')
+    snapshot = et.scan()
+    for bank in ('ai', 'ao', 'di', 'do'):
+        assert snapshot[bank] is not None
+    assert len(snapshot['ai']) == et.ai_n
+    assert et.snapshot_values('ai') == et.ai_read()
+
+
+def test_channel_reads_are_served_from_snapshot():
+    et = FakeET7000('fake', type='7026', max_age=10.0)
+    counter = CallCounter(et.client, 'read_input_registers')
+    values = [et.ai_read_channel(k) for k in range(et.ai_n)]
+    assert counter.count == 1
+    assert values == et.snapshot_values('ai')
+
+
+def test_channel_reads_without_snapshot():
+    et = FakeET7000('fake', type='7026', max_age=0.0)
+    counter = CallCounter(et.client, 'read_input_registers')
+    for k in range(et.ai_n):
+        et.ai_read_channel(k)
+    assert counter.count == et.ai_n
+
+
+def test_snapshot_expires():
+    et = FakeET7000('fake', type='7026', max_age=0.05)
+    counter = CallCounter(et.client, 'read_input_registers')
+    et.ai_read_channel(0)
+    et.ai_read_channel(1)
+    time.sleep(0.1)
+    et.ai_read_channel(0)
+    assert counter.count == 2
+
+
+def test_read_all_banks_in_one_scan(stand_in):
+    et = ET7000('127.0.0.1', port=stand_in.port, max_age=0.0)
+    try:
+        requests = et.client.stats.requests
+        result = et.read_all()
+        # one transaction per bank
+        assert et.client.stats.requests - requests == 4
+        assert result['ai'] == et.ai_read()
+        assert result['ao'] == et.ao_read()
+        assert len(result['di']) == et.di_n and len(result['do']) == et.do_n
+    finally:
+        et.__del__()
+
+
+def test_bit_banks_are_kept_as_masks():
+    et = FakeET7000('fake', type='7026', max_age=10.0)
+    assert et.do_write([True, False])
+    mask = et.do_read_mask()
+    assert isinstance(mask, int) and mask == 0b01
+    assert et.do_read() == [True, False]
+    assert et.do_read_channel(0) is True
+    assert et.di_read() == [bool((et.di_read_mask() >> k) & 1) for k in range(et.di_n)]
+
+
+def test_channel_writes_do_not_touch_other_channels():
+    FakeET7000.load_profiles(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ET7000_profiles.json'))
+    et = FakeET7000('fake', type='7044', max_age=10.0, output_readback=10.0)
+    assert et.do_write([True] * et.do_n)
+    # another master switches channel 1 off, cached outputs are not updated
+    et.client.write_multiple_coils(1, [False])
+    assert et.do_write_channels({0: False, 2: False, 3: False}) == {0: True, 2: True, 3: True}
+    assert et.client.read_coils(0, 5) == [False, False, False, False, True]
+    # written channels are cached, channel 1 is updated by the next readback
+    assert et.do_read_mask() & 0b11101 == 0b10000
+
+
+def test_ao_channel_writes():
+    et = FakeET7000('fake', type='7026')
+    assert et.ao_write_channels({0: 0.25}) == {0: True}
+    assert abs(et.ao_read()[0] - 0.25) < 1e-3
+    assert et.ao_write_channels({0: 0.25, et.ao_n: 0.5}) == {0: False, et.ao_n: False}
+
+
+def test_outputs_are_served_from_written_values():
+    et = FakeET7000('fake', type='7026', max_age=0.0, output_readback=10.0)
+    assert et.do_write([True, False])
+    counter = CallCounter(et.client, 'read_coils_packed')
+    assert et.do_read() == [True, False]
+    assert et.do_read_channel(1) is False
+    assert counter.count == 0
+    # failed write invalidates cache, outputs are read back
+    et.client.write_single_coil = lambda k, v: False
+    assert not et.do_write_channel(0, False)
+    assert et.do_read() == [True, False]
+    assert counter.count == 1
+
+
+def test_outputs_are_read_back_after_readback_period():
+    et = FakeET7000('fake', type='7026', max_age=0.0, output_readback=0.05)
+    assert et.do_write([True, True])
+    et.client.write_multiple_coils(0, [False, False])
+    assert et.do_read() == [True, True]
+    time.sleep(0.1)
+    assert et.do_read() == [False, False]
+
+
+def test_acquisition_fills_ring_buffer():
+    et = FakeET7000('fake', type='7026')
+    assert et.start_acquisition(100)
+    time.sleep(0.1)
+    et.stop_acquisition()
+    times, values = et.acquisition_values(10)
+    assert values.shape == (10, et.ai_n)
+    assert np.all(np.diff(times) >= 0.0)
+    assert np.allclose(values[-1], et.snapshot_values('ai'), equal_nan=True)
+    assert len(et.acquisition) == 100
+    # rate is reported only while acquiring
+    assert et.acquisition_rate() == 0.0
+
+
+def test_acquisition_survives_transport_exceptions():
+    et = FakeET7000('fake', type='7026')
+    et.timeout = 0.01
+    read = et.client.read_input_registers
+    calls = [0]
+
+    def failing_read(addr, n):
+        calls[0] += 1
+        if calls[0] % 10 == 0:
+            raise TimeoutError('transport timeout')
+        return read(addr, n)
+
+    et.client.read_input_registers = failing_read
+    et.start_acquisition(1000)
+    try:
+        time.sleep(0.2)
+        assert et.acquisition_thread.is_alive()
+        assert et.acquisition_errors >= 1
+        count = et.acquisition.count
+        time.sleep(0.05)
+        assert et.acquisition.count > count
+    finally:
+        et.stop_acquisition()
+
+
+def test_scan_of_listed_banks_only():
+    et = FakeET7000('fake', type='7026')
+    et.scan()
+    counter = CallCounter(et.client, 'read_coils_packed')
+    et.scan(0.0, ['ai', 'ao'])
+    assert counter.count == 0
+    et.scan(0.0)
+    assert counter.count == 1
+
+
+def test_read_modbus_multi():
+    et = FakeET7000('fake', type='7026')
+    result = et.read_modbus_multi([30000, 30001, 30005, 40559, 1, 10001, 20000])
+    assert result == {30000: 0, 30001: 1, 30005: 5, 40559: 0x7026, 1: True, 10001: True, 20000: None}
+
+
+def test_read_modbus_multi_repeats_rejected_gaps():
+    et = FakeET7000('fake', type='7026')
+    calls = []
+    client_calls = et._client_calls
+    et._client_calls = lambda c: calls.append(c) or client_calls(c)
+    # holding registers between 0 and 100 are not defined in emulated module
+    result = et.read_modbus_multi([40000, 40100, 40559], gap=200)
+    assert result[40559] == 0x7026
+    assert calls[0] == [('read_holding_registers', 0, 101), ('read_holding_registers', 559, 1)]
+    assert calls[1] == [('read_holding_registers', 0, 1), ('read_holding_registers', 100, 1)]
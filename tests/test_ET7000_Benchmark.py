@@ -0,0 +1,16 @@
+from ET7000_Benchmark import bench_conversion, bench_reads, measure
+from ET7000 import FakeET7000
+
+
+def test_measure():
+    calls = []
+    result = measure(lambda: calls.append(1), 10, repeat=2)
+    assert len(calls) == 20
+    assert result['n'] == 10 and result['ops_per_s'] > 0.0
+
+
+def test_quick_benchmarks_run():
+    reads = bench_reads(FakeET7000('fake', type='7026'), 5)
+    assert set(reads) >= {'ai_read_block', 'scan', 'read_all', 'ai_read_channel_snapshot'}
+    conversion = bench_conversion(5)
+    assert conversion['table_values']['items_per_s'] > 0.0
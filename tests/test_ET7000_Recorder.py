@@ -0,0 +1,55 @@
+import os
+import time
+
+import numpy as np
+
+from ET7000 import FakeET7000
+from ET7000_Recorder import ET7000Recorder, chunk_files, read_records, record_values
+
+
+def record(directory, et, n, chunk_records):
+    recorder = ET7000Recorder(str(directory), chunk_records=chunk_records)
+    recorder.start()
+    for i in range(n):
+        et.scan()
+        assert recorder.record('test/dev/1', et, t=1000.0 + i)
+    recorder.stop()
+    return recorder
+
+
+def test_records_roundtrip(tmp_path):
+    et = FakeET7000('fake', type='7026')
+    recorder = record(tmp_path, et, 10, 4)
+    assert recorder.report()['recorded'] == 10
+    path = os.path.join(str(tmp_path), 'test_dev_1')
+    # 10 records in chunks of 4
+    assert len(chunk_files(path)) == 3
+    chunks = read_records(path)
+    assert [len(records) for layout, records in chunks] == [4, 4, 2]
+    layout, records = chunks[-1]
+    values = record_values(layout, records)
+    assert values['time'].tolist() == [1008.0, 1009.0]
+    assert np.allclose(values['ai'][-1], et.snapshot_values('ai'), equal_nan=True)
+    assert values['do'][-1].tolist() == et.snapshot_values('do')
+
+
+def test_missing_bank_is_nan(tmp_path):
+    et = FakeET7000('fake', type='7026')
+    et.scan()
+    et.snapshot['ai'] = None
+    recorder = ET7000Recorder(str(tmp_path), chunk_records=4)
+    recorder.start()
+    recorder.record('dev', et, t=time.time())
+    recorder.stop()
+    layout, records = read_records(os.path.join(str(tmp_path), 'dev'))[0]
+    values = record_values(layout, records)
+    assert np.isnan(values['ai']).all()
+    assert not np.isnan(values['ao']).any()
+
+
+def test_new_chunk_is_started_after_restart(tmp_path):
+    et = FakeET7000('fake', type='7026')
+    record(tmp_path, et, 2, 100)
+    record(tmp_path, et, 3, 100)
+    chunks = read_records(os.path.join(str(tmp_path), 'test_dev_1'))
+    assert [len(records) for layout, records in chunks] == [2, 3]
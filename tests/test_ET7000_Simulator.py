@@ -0,0 +1,61 @@
+import asyncio
+import struct
+import time
+from threading import Thread
+
+import pytest
+
+from ET7000 import ET7000
+from ET7000_Simulator import ET7000Simulator, SimulatedModule
+
+
+def test_module_responses():
+    module = SimulatedModule('7026')
+    assert module.process(struct.pack('>BHH', 3, 559, 1)) == struct.pack('>BBH', 3, 2, 0x7026)
+    assert module.process(struct.pack('>BHH', 5, 0, 0xFF00)) == struct.pack('>BHH', 5, 0, 0xFF00)
+    assert module.process(struct.pack('>BHH', 1, 0, 1)) == bytes([1, 1, 1])
+    # illegal address and illegal function
+    assert module.process(struct.pack('>BHH', 4, 9000, 1)) == bytes([0x84, 2])
+    assert module.process(bytes([0x2B, 0, 0])) == bytes([0xAB, 1])
+
+
+@pytest.fixture
+def simulator():
+    # simulator of two modules on free ports served by event loop in background thread
+    loop = asyncio.new_event_loop()
+    simulator = ET7000Simulator(port=0, count=0)
+    simulator.modules = [SimulatedModule('7026'), SimulatedModule('7015', loss=1.0)]
+
+    async def start():
+        for module in simulator.modules:
+            simulator.servers.append(await asyncio.start_server(module.handle, '127.0.0.1', 0))
+
+    loop.run_until_complete(start())
+    thread = Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield [s.sockets[0].getsockname()[1] for s in simulator.servers]
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.run_until_complete(simulator.stop())
+    loop.close()
+
+
+def test_driver_against_simulator(simulator):
+    et = ET7000('127.0.0.1', port=simulator[0])
+    try:
+        assert et.type == 0x7026
+        assert (et.ai_n, et.ao_n, et.di_n, et.do_n) == (6, 1, 2, 2)
+        assert et.do_write([True, False]) and et.do_read() == [True, False]
+    finally:
+        et.__del__()
+
+
+def test_lost_responses_time_out(simulator):
+    et = ET7000('127.0.0.1', port=simulator[1], timeout=0.1)
+    try:
+        t0 = time.monotonic()
+        assert et.type == 0
+        assert time.monotonic() - t0 < 2.0
+        assert et.client.stats.report()['timeouts'] >= 1
+    finally:
+        et.__del__()
@@ -0,0 +1,43 @@
+import json
+import os
+
+from ET7000 import FakeET7000, RegisterBank
+
+PROFILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ET7000_profiles.json')
+
+
+def test_register_bank():
+    bank = RegisterBank()
+    assert bank.write(2, [1, 0x1FFFF])
+    assert bank.read(2, 2) == [1, 0xFFFF]
+    # undefined addresses are errors like on device
+    assert bank.read(1, 2) is None
+    assert bank.read(3, 2) is None
+    assert bank.is_defined(2, 2) and not bank.is_defined(0, 1)
+
+
+def test_bit_bank():
+    bank = RegisterBank(bits=True)
+    bank.write(0, [True, False, True] + [False] * 6 + [True])
+    assert bank.read(0, 3) == [True, False, True]
+    assert bank.read_packed(0, 10) == 0b1000000101
+    assert bank.read_packed(1, 2) == 0b10
+    assert bank.read_packed(5, 10) is None
+
+
+def test_profiles_from_json(tmp_path):
+    file_name = tmp_path / 'profiles.json'
+    file_name.write_text(json.dumps({'7999': {'30300': 0, '30310': 1, '30320': 3, '30330': 0,
+                                              '30000': [1, 2, 3], '40559': 0x7999}}))
+    assert FakeET7000.load_profiles(str(file_name)) == ['7999']
+    et = FakeET7000('fake', type='7999')
+    assert et.type == 0x7999
+    assert et.client.read_input_registers(0, 3) == [1, 2, 3]
+    assert (et.ai_n, et.ao_n, et.di_n, et.do_n) == (3, 0, 0, 1)
+
+
+def test_shipped_profiles():
+    for module_type in FakeET7000.load_profiles(PROFILES):
+        et = FakeET7000('fake', type=module_type)
+        assert et.type == int(module_type, 16)
+        assert et.read_all() is not None
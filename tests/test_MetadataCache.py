@@ -0,0 +1,73 @@
+import json
+import os
+import sys
+import time
+
+from ET7000 import ET7000, MetadataCache
+
+
+def test_write_and_read(tmp_path):
+    cache = MetadataCache.get(str(tmp_path / 'metadata.json'))
+    assert cache.read('a') is None
+    assert cache.write('a', {'type': 1})
+    assert MetadataCache(cache.file_name).read('a') == {'type': 1}
+    assert [f for f in os.listdir(tmp_path) if f.endswith('.tmp')] == []
+
+
+def test_writers_of_one_file_keep_entries_of_each_other(tmp_path):
+    # two caches for one file stand for two server processes
+    file_name = str(tmp_path / 'metadata.json')
+    first = MetadataCache(file_name)
+    second = MetadataCache(file_name)
+    first.read('x')
+    second.read('x')
+    first.write('a', {'type': 1})
+    second.write('b', {'type': 2})
+    first.write('c', {'type': 3})
+    with open(file_name) as f:
+        assert json.load(f) == {'a': {'type': 1}, 'b': {'type': 2}, 'c': {'type': 3}}
+
+
+def test_stale_entries_of_other_writer_are_not_restored(tmp_path):
+    file_name = str(tmp_path / 'metadata.json')
+    first = MetadataCache(file_name)
+    second = MetadataCache(file_name)
+    first.write('x', {'value': 'old'})
+    second.write('x', {'value': 'new'})
+    first.write('y', {'value': 'y'})
+    with open(file_name) as f:
+        assert json.load(f) == {'x': {'value': 'new'}, 'y': {'value': 'y'}}
+    # in memory data is refreshed from written file
+    assert first.read('x') == {'value': 'new'}
+
+
+def test_relative_name_is_resolved_against_module_directory():
+    cache = MetadataCache.get('test_metadata_cache.json')
+    assert os.path.dirname(cache.file_name) == os.path.dirname(os.path.abspath(sys.modules['ET7000'].__file__))
+    assert MetadataCache.get(cache.file_name) is cache
+
+
+def test_reconnection_uses_cached_configuration(stand_in, tmp_path):
+    cache = str(tmp_path / 'metadata.json')
+    et = ET7000('127.0.0.1', port=stand_in.port, metadata_cache=cache)
+    et.__del__()
+    cached = ET7000('127.0.0.1', port=stand_in.port, metadata_cache=cache)
+    cached.__del__()
+    # only module type is read
+    assert et.client.stats.requests > 5
+    assert cached.client.stats.requests == 1
+    assert (cached.ai_n, cached.ai_ranges, cached.ao_n, cached.di_n, cached.do_n) == \
+           (et.ai_n, et.ai_ranges, et.ao_n, et.di_n, et.do_n)
+
+
+def test_expired_configuration_is_read_from_device(stand_in, tmp_path):
+    cache = str(tmp_path / 'metadata.json')
+    ET7000('127.0.0.1', port=stand_in.port, metadata_cache=cache).__del__()
+    cached = ET7000('127.0.0.1', port=stand_in.port, metadata_cache=cache, metadata_max_age=100.0)
+    cached.__del__()
+    assert cached.discovery_time == 0.0
+    time.sleep(0.01)
+    expired = ET7000('127.0.0.1', port=stand_in.port, metadata_cache=cache, metadata_max_age=0.001)
+    expired.__del__()
+    assert expired.discovery_time > 0.0
+    assert expired.client.stats.requests > 1
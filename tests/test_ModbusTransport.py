@@ -0,0 +1,170 @@
+import socket
+import struct
+import time
+from threading import Thread
+
+from ModbusTransport import FairLock, ModbusTransport, address_table, build_request, decode_pdu, mbap, pack_bits, \
+    pack_mask, plan_reads, unpack_bits, unpack_mask
+
+
+def test_fair_lock_is_fifo():
+    lock = FairLock()
+    order = []
+
+    def worker(i):
+        with lock:
+            order.append(i)
+
+    threads = []
+    with lock:
+        # threads queue up one by one while the lock is held
+        for i in range(5):
+            t = Thread(target=worker, args=(i,))
+            t.start()
+            threads.append(t)
+            time.sleep(0.02)
+    for t in threads:
+        t.join()
+    assert order == list(range(5))
+
+
+def test_bits_roundtrip():
+    bits = [True, False, True, True, False, False, False, True, True]
+    data = pack_bits(bits)
+    assert data == bytes([0x8D, 0x01])
+    assert unpack_bits(data, len(bits)) == bits
+
+
+def test_mask_roundtrip():
+    bits = [True, False, False, True] + [False] * 59 + [True]
+    mask = pack_mask(bits)
+    assert mask == (1 << 63) | 0b1001
+    assert unpack_mask(mask, len(bits)) == bits
+    assert pack_mask([]) == 0
+
+
+def test_packed_bits_response():
+    fc, n, pdu = build_request('read_coils_packed', 0, 10)
+    # unused high bits of the last byte are ignored
+    assert decode_pdu(fc, n, bytes([1, 2, 0x05, 0xFE]), packed=True) == 0x205
+    assert decode_pdu(fc, n, bytes([1, 2, 0x05, 0xFE])) == unpack_mask(0x205, 10)
+
+
+def test_read_request_and_response():
+    fc, n, pdu = build_request('read_input_registers', 3, 2)
+    assert pdu == struct.pack('>BHH', 4, 3, 2)
+    assert decode_pdu(fc, n, struct.pack('>BBHH', 4, 4, 100, 0xFFFF)) == [100, 0xFFFF]
+    # exception response and short response are errors
+    assert decode_pdu(fc, n, bytes([0x84, 2])) is None
+    assert decode_pdu(fc, n, struct.pack('>BBH', 4, 2, 100)) is None
+
+
+def test_write_response():
+    fc, n, pdu = build_request('write_multiple_coils', 0, [True, False, True])
+    assert pdu == struct.pack('>BHHBB', 15, 0, 3, 1, 0x05)
+    assert decode_pdu(fc, n, pdu[:5]) is True
+
+
+def test_transport_reads_and_writes(stand_in):
+    client = ModbusTransport('127.0.0.1', stand_in.port)
+    try:
+        assert client.read_holding_registers(559, 1) == [0x7026]
+        assert client.write_multiple_registers(0, [1234])
+        assert client.read_holding_registers(0, 1) == [1234]
+        assert client.write_single_coil(1, True)
+        assert client.read_coils(0, 2)[1] is True
+        # illegal address is an error, connection stays usable
+        assert client.read_input_registers(9000, 1) is None
+        assert client.read_input_registers(0, 2) is not None
+    finally:
+        client.close()
+
+
+def reversing_server(n):
+    # server answering every n pipelined requests in reverse order, returns (listening socket, port)
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    def serve():
+        conn, address = listener.accept()
+        with conn:
+            buf = b''
+            while True:
+                frames = []
+                while len(frames) < n:
+                    while len(buf) < 7 or len(buf) < 6 + struct.unpack('>H', buf[4:6])[0]:
+                        data = conn.recv(4096)
+                        if not data:
+                            return
+                        buf += data
+                    size = 6 + struct.unpack('>H', buf[4:6])[0]
+                    frames.append(buf[:size])
+                    buf = buf[size:]
+                for frame in reversed(frames):
+                    tid, pid, length, unit_id = struct.unpack('>HHHB', frame[:7])
+                    # response is input register equal to requested address
+                    addr = struct.unpack('>H', frame[8:10])[0]
+                    conn.sendall(mbap(tid, struct.pack('>BBH', 4, 2, addr), unit_id))
+
+    Thread(target=serve, daemon=True).start()
+    return listener, listener.getsockname()[1]
+
+
+def test_pipelined_responses_are_matched_by_transaction_id():
+    listener, port = reversing_server(4)
+    client = ModbusTransport('127.0.0.1', port, window=4)
+    try:
+        results = client.batch([('read_input_registers', addr, 1) for addr in range(8)])
+        assert results == [[addr] for addr in range(8)]
+    finally:
+        client.close()
+        listener.close()
+
+
+def test_batch_of_mixed_requests(stand_in):
+    client = ModbusTransport('127.0.0.1', stand_in.port, window=3)
+    try:
+        results = client.batch([('read_holding_registers', 559, 1),
+                                ('write_multiple_coils', 0, [True, True]),
+                                ('read_coils_packed', 0, 2),
+                                ('read_input_registers', 9000, 1),
+                                ('read_input_registers', 0, 6)])
+        assert results[:4] == [[0x7026], True, 3, None]
+        assert len(results[4]) == 6
+        assert client.stats.report()['requests'] == 5
+    finally:
+        client.close()
+
+
+def test_address_table():
+    assert address_table(0) == 0
+    assert address_table(10001) == 10000
+    assert address_table(30559) == 30000
+    assert address_table(40000) == 40000
+    assert address_table(20000) is None
+    assert address_table(-1) is None
+    assert address_table(40000 + 0x10000) is None
+
+
+def test_plan_merges_addresses_within_gap():
+    plan = plan_reads([40001, 40003, 40010, 30000, 30001, 10000, 0, 5, 20001], gap=2)
+    assert plan == [('read_coils', 0, 0, 1),
+                    ('read_coils', 0, 5, 1),
+                    ('read_discrete_inputs', 10000, 0, 1),
+                    ('read_input_registers', 30000, 0, 2),
+                    ('read_holding_registers', 40000, 1, 3),
+                    ('read_holding_registers', 40000, 10, 1)]
+    assert plan_reads([0, 5], gap=4) == [('read_coils', 0, 0, 6)]
+    # duplicates are read once
+    assert plan_reads([30001, 30001]) == [('read_input_registers', 30000, 1, 1)]
+
+
+def test_plan_respects_pdu_limits():
+    plan = plan_reads(range(40000, 40300))
+    assert [p[3] for p in plan] == [125, 125, 50]
+    plan = plan_reads(range(0, 4001))
+    assert [p[3] for p in plan] == [2000, 2000, 1]
+    # gap never makes request longer than limit
+    plan = plan_reads([30000, 30124, 30125], gap=200)
+    assert plan == [('read_input_registers', 30000, 0, 125), ('read_input_registers', 30000, 125, 1)]
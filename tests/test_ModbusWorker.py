@@ -0,0 +1,102 @@
+import time
+from threading import Thread
+
+from ModbusTransport import ModbusWorker, PRIORITY_READ, PRIORITY_SCAN, PRIORITY_WRITE, RequestLanes, \
+    current_priority, read_pdu, request_priority, write_single_coil_pdu
+
+
+def test_requests_of_many_threads_share_one_worker(stand_in):
+    client = ModbusWorker('127.0.0.1', stand_in.port)
+    results = []
+
+    def read():
+        for i in range(20):
+            results.append(client.read_holding_registers(559, 1))
+
+    threads = [Thread(target=read) for i in range(4)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == [[0x7026]] * 80
+        assert client.batch([('read_input_registers', 0, 6), ('read_coils_packed', 0, 2)])[0] is not None
+    finally:
+        client.close()
+
+
+def test_worker_restarts_after_close(stand_in):
+    client = ModbusWorker('127.0.0.1', stand_in.port)
+    assert client.read_holding_registers(559, 1) == [0x7026]
+    thread = client.thread
+    assert client.close()
+    thread.join(1.0)
+    assert not thread.is_alive() and not client.is_open
+    assert client.read_holding_registers(559, 1) == [0x7026]
+    assert client.thread is not thread
+    client.close()
+
+
+def test_submit_returns_future(stand_in):
+    client = ModbusWorker('127.0.0.1', stand_in.port)
+    try:
+        future = client.submit([read_pdu(3, 559, 1)], PRIORITY_SCAN)
+        assert future.result(1.0)[0][2:] == b'\x70\x26'
+        assert client.stats.wait_histogram(PRIORITY_SCAN).n == 1
+    finally:
+        client.close()
+
+
+def request(n=1):
+    # lanes hold (pdus, future)
+    return [read_pdu(4, 0, 1)] * n, None
+
+
+def test_lanes_serve_higher_priority_first():
+    lanes = RequestLanes(starvation_limit=10.0)
+    lanes.put(PRIORITY_SCAN, request())
+    lanes.put(PRIORITY_READ, request())
+    lanes.put(PRIORITY_WRITE, request())
+    assert lanes.depths() == [1, 1, 1, 0]
+    assert [item[0] for item in lanes.get(4)] == [PRIORITY_WRITE]
+    assert [item[0] for item in lanes.get(4)] == [PRIORITY_READ]
+    assert [item[0] for item in lanes.get(4)] == [PRIORITY_SCAN]
+
+
+def test_lanes_round_is_one_class_up_to_max_pdus():
+    lanes = RequestLanes(starvation_limit=10.0)
+    for i in range(3):
+        lanes.put(PRIORITY_SCAN, request(2))
+    lanes.put(PRIORITY_READ, request())
+    assert len(lanes.get(4)) == 1
+    items = lanes.get(4)
+    assert [item[0] for item in items] == [PRIORITY_SCAN, PRIORITY_SCAN]
+    assert len(lanes.get(4)) == 1
+    # request larger than max_pdus is still served
+    lanes.put(PRIORITY_SCAN, request(6))
+    assert len(lanes.get(4)) == 1
+
+
+def test_starving_request_is_served_first():
+    lanes = RequestLanes(starvation_limit=0.05)
+    lanes.put(PRIORITY_SCAN, request())
+    time.sleep(0.1)
+    lanes.put(PRIORITY_WRITE, request())
+    assert [item[0] for item in lanes.get(4)] == [PRIORITY_SCAN]
+    assert [item[0] for item in lanes.get(4)] == [PRIORITY_WRITE]
+
+
+def test_stopped_lanes_are_drained():
+    lanes = RequestLanes()
+    lanes.put(PRIORITY_READ, request())
+    lanes.stop()
+    assert len(lanes.get(4)) == 1
+    assert lanes.get(4) is None
+
+
+def test_priority_from_context_and_function_codes():
+    assert current_priority([read_pdu(4, 0, 1)]) == PRIORITY_READ
+    assert current_priority([read_pdu(4, 0, 1), write_single_coil_pdu(0, True)]) == PRIORITY_WRITE
+    with request_priority(PRIORITY_SCAN):
+        assert current_priority([write_single_coil_pdu(0, True)]) == PRIORITY_SCAN
+    assert current_priority([read_pdu(4, 0, 1)]) == PRIORITY_READ
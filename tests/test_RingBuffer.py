@@ -0,0 +1,52 @@
+import numpy as np
+
+from RingBuffer import RingBuffer, decimate
+
+
+def test_latest_rows_in_order_after_wrap():
+    buffer = RingBuffer(4, 2)
+    for i in range(6):
+        buffer.append([i, -i], float(i))
+    times, rows = buffer.latest()
+    assert len(buffer) == 4
+    assert times.tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert rows[:, 0].tolist() == [2, 3, 4, 5]
+    assert buffer.latest(2)[0].tolist() == [4.0, 5.0]
+
+
+def test_between():
+    buffer = RingBuffer(10, 3)
+    for i in range(10):
+        buffer.append([i, 10 * i, 100 * i], float(i))
+    times, values = buffer.between(2.0, 5.0, 1)
+    # t0 < time <= t1
+    assert times.tolist() == [3.0, 4.0, 5.0]
+    assert values.tolist() == [30, 40, 50]
+    assert buffer.between(7.0, float('inf'))[0].tolist() == [8.0, 9.0]
+    assert len(buffer.between(20.0, 30.0)[0]) == 0
+
+
+def test_rate():
+    buffer = RingBuffer(100, 1)
+    for i in range(11):
+        buffer.append([0], i * 0.1)
+    assert abs(buffer.rate() - 10.0) < 1e-9
+    buffer.clear()
+    assert buffer.rate() == 0.0
+
+
+def test_decimate():
+    times = np.arange(100.0)
+    values = np.arange(100.0)
+    centers, v_min, v_max, v_mean = decimate(times, values, 4, 0.0, 100.0)
+    assert centers.tolist() == [12.5, 37.5, 62.5, 87.5]
+    assert v_min.tolist() == [0.0, 25.0, 50.0, 75.0]
+    assert v_max.tolist() == [24.0, 49.0, 74.0, 99.0]
+    assert v_mean.tolist() == [12.0, 37.0, 62.0, 87.0]
+
+
+def test_decimate_skips_empty_bins():
+    centers, v_min, v_max, v_mean = decimate([0.5, 3.5], [1.0, 2.0], 4, 0.0, 4.0)
+    assert centers.tolist() == [0.5, 3.5]
+    assert v_mean.tolist() == [1.0, 2.0]
+    assert all(len(a) == 0 for a in decimate([], [], 4))
@@ -0,0 +1,111 @@
+import time
+
+from ScanScheduler import AdaptiveRate, AdaptiveScan, ScanScheduler
+
+
+def run_scheduler(jobs, duration, workers=4):
+    # jobs: {name: (function, period)}, returns report after duration
+    scheduler = ScanScheduler(workers)
+    for name, (function, period) in jobs.items():
+        scheduler.add(name, function, period)
+    scheduler.start()
+    time.sleep(duration)
+    scheduler.stop()
+    # wait for running scans
+    scheduler.executor.shutdown()
+    return scheduler.report()
+
+
+def test_jobs_run_with_their_periods():
+    report = run_scheduler({'fast': (lambda: None, 0.02), 'slow': (lambda: None, 0.1)}, 0.5)
+    assert 15 <= report['fast']['count'] <= 27
+    assert 4 <= report['slow']['count'] <= 7
+    assert report['fast']['overruns'] == 0
+
+
+def test_slow_job_does_not_delay_others():
+    report = run_scheduler({'dead': (lambda: time.sleep(0.3), 0.02), 'fast': (lambda: None, 0.02)}, 0.5)
+    # dead device occupies one worker, its missed cycles are skipped, not queued
+    assert report['dead']['count'] <= 2
+    assert report['dead']['overruns'] >= 1
+    assert report['fast']['count'] >= 15
+
+
+def test_exceptions_are_counted():
+    def fail():
+        raise RuntimeError('scan error')
+
+    report = run_scheduler({'bad': (fail, 0.05)}, 0.3)
+    assert report['bad']['count'] >= 5
+    assert report['bad']['errors'] == report['bad']['count']
+
+
+def test_submit_runs_once():
+    scheduler = ScanScheduler(2)
+    assert scheduler.submit(lambda x: x + 1, 1).result(1.0) == 2
+    scheduler.executor.shutdown()
+
+
+def test_blocking_background_jobs_do_not_delay_scans():
+    # more hanging reconnections than scan workers
+    scheduler = ScanScheduler(2, background_workers=2)
+    scheduler.add('healthy', lambda: None, 0.02)
+    for i in range(4):
+        scheduler.submit_background(time.sleep, 0.5)
+    scheduler.start()
+    time.sleep(0.3)
+    scheduler.stop()
+    scheduler.executor.shutdown()
+    assert scheduler.report('healthy')['count'] >= 10
+    scheduler.background.shutdown()
+
+
+def test_quiet_bank_backs_off_to_max_period():
+    rate = AdaptiveRate(0.1, 2.0, resolution=0.01)
+    t = 0.0
+    for i in range(20):
+        rate.update([1.0, 2.0], t)
+        t = rate.next_time
+    assert rate.period == 2.0
+    assert rate.activity == 0.0
+
+
+def test_active_bank_speeds_up_at_once():
+    rate = AdaptiveRate(0.1, 2.0, resolution=0.01)
+    rate.period = 2.0
+    rate.update([0.0], 0.0, [10.0])
+    # 1 % of span in 2 s wants 2 s period, 10 % wants 0.2 s
+    rate.update([1.0], 2.0, [10.0])
+    assert abs(rate.period - 0.2) < 1e-9
+    assert rate.next_time == 2.0 + rate.period
+    # faster change is limited by min period
+    rate.update([10.0], 2.2, [10.0])
+    assert rate.period == 0.1
+
+
+def test_nan_and_failed_reads_are_ignored():
+    rate = AdaptiveRate(0.1, 2.0)
+    rate.update([0.0, float('nan')], 0.0)
+    rate.update([0.0, 5.0], 1.0)
+    assert rate.activity == 0.0
+    rate.update(None, 2.0)
+    assert rate.next_time == 2.0 + rate.period
+
+
+def test_budget_stretches_all_periods():
+    scan = AdaptiveScan(['ai', 'di'], 0.1, 10.0, budget=5.0)
+    assert sorted(scan.due(0.0)) == ['ai', 'di']
+    scan.update('ai', [0.0], 0.0)
+    scan.update('di', [False], 0.0)
+    # both banks at 0.1 s want 20 reads/s, budget 5 stretches periods 4 times
+    for bank, report in scan.report().items():
+        assert abs(report['period'] - 0.4) < 1e-9
+    assert sum(r['rate'] for r in scan.report().values()) <= 5.0 + 1e-9
+    assert scan.due(0.2) == []
+    assert sorted(scan.due(0.4)) == ['ai', 'di']
+
+
+def test_no_budget_limit():
+    scan = AdaptiveScan(['ai'], 0.1, 10.0, budget=0.0)
+    scan.update('ai', [0.0], 0.0)
+    assert scan.report()['ai']['period'] == 0.1
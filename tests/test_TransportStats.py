@@ -0,0 +1,74 @@
+from ModbusTransport import LatencyHistogram, ModbusTransport, READ_COILS, READ_INPUT_REGISTERS, TransportStats
+
+
+def test_percentiles_within_bucket_accuracy():
+    histogram = LatencyHistogram()
+    # 1 ms to 100 ms uniformly
+    for i in range(1, 101):
+        histogram.add(i * 1e-3)
+    assert histogram.n == 100
+    assert 0.050 <= histogram.percentile(50.0) <= 0.050 * 1.2
+    assert 0.099 <= histogram.percentile(99.0) <= 0.100
+    assert histogram.percentile(100.0) == histogram.max == 0.1
+    assert abs(histogram.report()['mean'] - 0.0505) < 1e-9
+
+
+def test_merge():
+    a = LatencyHistogram()
+    b = LatencyHistogram()
+    a.add(1e-3)
+    b.add(2e-3)
+    b.add(1e-6)
+    a.merge(b)
+    assert a.n == 3 and a.max == 2e-3
+    assert LatencyHistogram().percentile(50.0) == 0.0
+
+
+def test_stats_per_function_and_errors():
+    stats = TransportStats()
+    stats.add(READ_INPUT_REGISTERS, 1e-3)
+    stats.add(READ_INPUT_REGISTERS, 3e-3)
+    stats.add_error(READ_COILS, timeout=True)
+    stats.add_error(READ_COILS)
+    report = stats.report()
+    assert report['requests'] == 4
+    assert report['errors'] == 2 and report['timeouts'] == 1
+    assert report['error_rate'] == 0.5
+    assert report['functions']['read_input_registers']['count'] == 2
+    assert report['functions']['read_coils']['errors'] == 2
+    stats.reset()
+    assert stats.report()['requests'] == 0
+
+
+def test_transport_counts_requests_and_errors(stand_in):
+    client = ModbusTransport('127.0.0.1', stand_in.port)
+    try:
+        client.read_input_registers(0, 6)
+        client.read_input_registers(9000, 1)
+        report = client.stats.report()
+        assert report['requests'] == 2 and report['errors'] == 1
+        assert report['functions']['read_input_registers']['count'] == 1
+    finally:
+        client.close()
+
+
+def test_connection_errors_are_counted():
+    # nothing listens on the port
+    client = ModbusTransport('127.0.0.1', 1, timeout=0.1)
+    assert client.read_input_registers(0, 1) is None
+    assert client.stats.report()['errors'] == 1
+
+
+def test_reopen_after_lost_connection_is_counted_as_reconnect(stand_in):
+    client = ModbusTransport('127.0.0.1', stand_in.port)
+    try:
+        assert client.read_input_registers(0, 1) is not None
+        # connection breaks under the transport, the failed request is not repeated
+        client.sock.close()
+        assert client.read_input_registers(0, 1) is None
+        assert client.read_input_registers(0, 1) is not None
+        report = client.stats.report()
+        assert report['reconnects'] == 1 and report['errors'] == 1 and report['requests'] == 3
+        assert client.stats.error_rate() == report['error_rate']
+    finally:
+        client.close()
@@ -0,0 +1,59 @@
+import os
+import time
+from threading import Thread
+
+from ET7000 import FakeET7000
+from WriteCoalescer import WriteCoalescer
+
+
+def test_writes_within_window_are_merged_and_last_write_wins():
+    flushed = []
+    coalescer = WriteCoalescer(lambda values: flushed.append(dict(values)) or True, window=0.05)
+    results = []
+
+    def write(channel, value, delay):
+        time.sleep(delay)
+        results.append(coalescer.write(channel, value))
+
+    threads = [Thread(target=write, args=args) for args in ((0, 1.0, 0.0), (1, 2.0, 0.01), (0, 3.0, 0.02))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert flushed == [{0: 3.0, 1: 2.0}]
+    assert results == [True, True, True]
+
+
+def test_per_channel_results():
+    # coil 5 fails, channel 0 in another run of the same batch is written and reported
+    FakeET7000.load_profiles(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'ET7000_profiles.json'))
+    et = FakeET7000('fake', type='7044')
+    write_coils = et.client.write_multiple_coils
+    et.client.write_multiple_coils = lambda n, v: False if n <= 5 < n + len(v) else write_coils(n, v)
+    coalescer = WriteCoalescer(et.do_write_channels, window=0.05)
+    results = {}
+
+    def write(channel):
+        results[channel] = coalescer.write(channel, True)
+
+    threads = [Thread(target=write, args=(k,)) for k in (0, 5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == {0: True, 5: False}
+    assert et.client.read_coils(0, 6) == [True, False, False, False, False, False]
+
+
+def test_per_channel_results_of_ao_writes():
+    et = FakeET7000('fake', type='7026')
+    coalescer = WriteCoalescer(et.ao_write_channels, window=0.0)
+    assert coalescer.write(0, 0.25) is True
+    assert coalescer.write(et.ao_n, 0.25) is False
+
+
+def test_flush_exception_fails_writers():
+    def flush(values):
+        raise RuntimeError('write error')
+
+    assert WriteCoalescer(flush, window=0.0).write(0, 1.0) is False